@@ -0,0 +1,309 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+from utils import Utils
+from db_handler import DBOperation
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for every file the pipeline downloads or renders.
+
+    Blobs live at `root/<sha[:2]>/<sha><ext>` and are indexed in the `artifacts` table with
+    their size, refcount and last access time. Callers address them through named refs in
+    `artifact_refs` ("audio/peter_audio_3.mp3", "archive/<timestamp>/...", "render/<key>"),
+    so identical bytes are stored once and archiving a file is just adding a ref.
+
+    Files the rest of the code reads by path (audio_assests/, image_assests/) are hard links
+    to the blob, not copies.
+
+    `gc()` deletes the least recently used blobs until the store fits in the byte budget.
+    `refcount` counts the refs that pin a blob (every ref outside EVICTABLE_PREFIXES); only
+    blobs with a refcount of 0 are evicted, so archive and cache refs do not keep a blob alive.
+    Downloaded images ("images/...") are a cache too: the copy in image_assests/ is a hard
+    link and survives eviction of the blob.
+
+    Env overrides:
+        ARTIFACT_STORE_DIR        where blobs live (default artifact_store)
+        ARTIFACT_STORE_BUDGET_MB  size gc() trims the store down to (default 2048)
+    """
+
+    EVICTABLE_PREFIXES = ("archive/", "render/", "image_search/", "images/", "plan/")
+    # temporary files older than this are left over from a crash
+    STALE_TMP_S = 3600
+
+    def __init__(self, db_name="stewie_database.db", root=None, budget_bytes=None):
+        self.db_name = db_name
+        self.root = root or os.getenv("ARTIFACT_STORE_DIR", "artifact_store")
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        self.budget_bytes = int(budget_bytes or float(os.getenv("ARTIFACT_STORE_BUDGET_MB", 2048)) * 1024 * 1024)
+        self.logger = logging.getLogger("ArtifactStore")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.create_tables()
+
+    def connect(self):
+        # same busy timeout as DBOperation: workers and pipeline threads share this file
+        return sqlite3.connect(self.db_name, timeout=DBOperation.BUSY_TIMEOUT_S)
+
+    def create_tables(self):
+        conn = None
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    sha256 TEXT PRIMARY KEY,
+                    ext TEXT,
+                    size INTEGER,
+                    refcount INTEGER DEFAULT 0,
+                    created_at REAL,
+                    last_access REAL
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS artifact_refs (
+                    name TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    updated_at REAL
+                );
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_artifact_refs_sha ON artifact_refs (sha256);")
+            # recount pins, so stores written before the prefixes changed are counted the same way
+            pinning = " AND ".join("r.name NOT LIKE ?" for _ in self.EVICTABLE_PREFIXES)
+            cursor.execute(f"""
+                UPDATE artifacts SET refcount = (
+                    SELECT COUNT(*) FROM artifact_refs r WHERE r.sha256 = artifacts.sha256 AND {pinning}
+                );
+            """, [prefix + "%" for prefix in self.EVICTABLE_PREFIXES])
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error during artifact table creation: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def blob_path(self, sha256, ext=""):
+        return os.path.join(self.root, sha256[:2], sha256 + ext)
+
+    def tmp_path(self, name):
+        """A scratch path inside the store (same filesystem, so put_file can rename it in)."""
+        return os.path.join(self.tmp_dir, f"{os.getpid()}_{name}")
+
+    @staticmethod
+    def _link_or_copy(src, dest):
+        if os.path.lexists(dest):
+            # never write through an old link: that would change the blob behind it
+            os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+
+    def _ingest(self, sha256, ext, size, place_blob, name, label):
+        """
+        Registers a blob and points `name` at it. A new blob's file is placed by
+        place_blob(path) before the row is written, and removed again if the index update
+        fails. Returns the blob path, or None if the index could not be updated.
+        """
+        created = None
+        conn = None
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            now = time.time()
+            row = cursor.execute("SELECT ext FROM artifacts WHERE sha256 = ?;", (sha256,)).fetchone()
+            if row and os.path.exists(self.blob_path(sha256, row[0])):
+                ext = row[0]
+                cursor.execute("UPDATE artifacts SET last_access = ? WHERE sha256 = ?;", (now, sha256))
+            else:
+                path = self.blob_path(sha256, ext)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if not os.path.exists(path):
+                    place_blob(path)
+                    created = path
+                os.chmod(path, 0o444)
+                cursor.execute("""
+                    INSERT INTO artifacts (sha256, ext, size, refcount, created_at, last_access)
+                    VALUES (?, ?, ?, 0, ?, ?)
+                    ON CONFLICT(sha256) DO UPDATE SET ext = excluded.ext, size = excluded.size,
+                        last_access = excluded.last_access;
+                """, (sha256, ext, size, now, now))
+            if name:
+                self._set_ref(cursor, name, sha256, now)
+            conn.commit()
+            return self.blob_path(sha256, ext)
+        except sqlite3.Error as e:
+            print(f"SQLite error while storing {label}: {e}")
+            if created:
+                os.remove(created)
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    @classmethod
+    def pins(cls, name):
+        """True if a ref with this name keeps its blob from being evicted."""
+        return not name.startswith(cls.EVICTABLE_PREFIXES)
+
+    def _set_ref(self, cursor, name, sha256, now):
+        row = cursor.execute("SELECT sha256 FROM artifact_refs WHERE name = ?;", (name,)).fetchone()
+        if row and row[0] == sha256:
+            return
+        if row and self.pins(name):
+            cursor.execute("UPDATE artifacts SET refcount = refcount - 1 WHERE sha256 = ?;", (row[0],))
+        cursor.execute("""
+            INSERT INTO artifact_refs (name, sha256, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET sha256 = excluded.sha256, updated_at = excluded.updated_at;
+        """, (name, sha256, now))
+        if self.pins(name):
+            cursor.execute("UPDATE artifacts SET refcount = refcount + 1 WHERE sha256 = ?;", (sha256,))
+
+    def put_file(self, path, name=None, keep=True):
+        """
+        Moves `path` into the store and returns the blob path. With keep=True, `path` is left
+        behind as a hard link to the blob, so readers of the old location are unaffected.
+        The source is only touched once the index row is committed; if that fails, `path`
+        is returned unchanged.
+        """
+        sha256 = Utils.file_sha256(path)
+        ext = os.path.splitext(path)[1].lower()
+        size = os.path.getsize(path)
+
+        def place_blob(blob):
+            # link, not move: the source must survive a failed index update
+            try:
+                os.link(path, blob)
+            except OSError:
+                shutil.copy2(path, blob)
+
+        blob = self._ingest(sha256, ext, size, place_blob, name, path)
+        if blob is None:
+            return path
+        if keep:
+            self._link_or_copy(blob, path)
+        else:
+            os.remove(path)
+        return blob
+
+    def put_bytes(self, data, ext, name=None):
+        """Stores `data` and returns the blob path (None if the index could not be updated)."""
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        def place_blob(blob):
+            tmp = self.tmp_path(sha256)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, blob)
+
+        return self._ingest(sha256, ext, len(data), place_blob, name, name or sha256)
+
+    def release(self, name):
+        """Drops a ref. The blob stays until gc() decides it is cold."""
+        conn = None
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            row = cursor.execute("SELECT sha256 FROM artifact_refs WHERE name = ?;", (name,)).fetchone()
+            if row:
+                cursor.execute("DELETE FROM artifact_refs WHERE name = ?;", (name,))
+                if self.pins(name):
+                    cursor.execute("UPDATE artifacts SET refcount = refcount - 1 WHERE sha256 = ?;", (row[0],))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error while releasing {name}: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def resolve(self, name):
+        """Blob path for a ref (and marks it as recently used), or None if it is not stored."""
+        conn = None
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            row = cursor.execute("""
+                SELECT a.sha256, a.ext FROM artifact_refs r JOIN artifacts a ON a.sha256 = r.sha256
+                WHERE r.name = ?;
+            """, (name,)).fetchone()
+            if not row:
+                return None
+            path = self.blob_path(row[0], row[1])
+            if not os.path.exists(path):
+                self.logger.warning(f"Blob for {name} is missing on disk, forgetting it")
+                cursor.execute("DELETE FROM artifact_refs WHERE sha256 = ?;", (row[0],))
+                cursor.execute("DELETE FROM artifacts WHERE sha256 = ?;", (row[0],))
+                conn.commit()
+                return None
+            cursor.execute("UPDATE artifacts SET last_access = ? WHERE sha256 = ?;", (time.time(), row[0]))
+            conn.commit()
+            return path
+        except sqlite3.Error as e:
+            print(f"SQLite error while resolving {name}: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def checkout(self, name, dest):
+        """Hard links the blob behind `name` to `dest`. Returns dest, or None if not stored."""
+        path = self.resolve(name)
+        if path is None:
+            return None
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        self._link_or_copy(path, dest)
+        return dest
+
+    def gc(self, budget_bytes=None):
+        """
+        Evicts cold blobs, least recently used first, until the store is within budget.
+        Returns the number of bytes freed.
+        """
+        budget = self.budget_bytes if budget_bytes is None else budget_bytes
+        self._remove_stale_tmp()
+        freed = 0
+        conn = None
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            total = cursor.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts;").fetchone()[0]
+            if total <= budget:
+                return 0
+            candidates = cursor.execute("""
+                SELECT sha256, ext, size FROM artifacts WHERE refcount <= 0 ORDER BY last_access ASC;
+            """).fetchall()
+            for sha256, ext, size in candidates:
+                if total - freed <= budget:
+                    break
+                try:
+                    os.remove(self.blob_path(sha256, ext))
+                except FileNotFoundError:
+                    pass
+                cursor.execute("DELETE FROM artifact_refs WHERE sha256 = ?;", (sha256,))
+                cursor.execute("DELETE FROM artifacts WHERE sha256 = ?;", (sha256,))
+                freed += size or 0
+            conn.commit()
+            if total - freed > budget:
+                self.logger.warning(
+                    f"Store is {total - freed} bytes after GC, over the {budget} byte budget; the rest is in use"
+                )
+        except sqlite3.Error as e:
+            print(f"SQLite error during artifact GC: {e}")
+        finally:
+            if conn:
+                conn.close()
+        print(f"Artifact GC freed {freed} bytes.")
+        return freed
+
+    def _remove_stale_tmp(self):
+        cutoff = time.time() - self.STALE_TMP_S
+        for filename in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
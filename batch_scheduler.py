@@ -0,0 +1,111 @@
+import os
+import time
+import logging
+
+
+class BatchScheduler:
+    """
+    Decides how many dialogue lines a stage 1 boot should claim, and how long to wait
+    before shutting the VM down.
+
+    The VM is only allowed to scrape for `boot_budget_s` seconds after it booted (after that
+    the IP is considered burnt and the VM is rotated). From the recent scrape history we
+    estimate how long one line takes and fit as many lines as the remaining budget allows.
+    On a machine that has been up longer than the budget (not a fresh VM: a dev box, a
+    benchmark host, several workers on one server) the budget counts from process start.
+    Every boot gets at least one line, however little budget is left.
+
+    Env overrides:
+        VM_BOOT_BUDGET_S      seconds a boot may spend before shutting down (default 600)
+        VM_MAX_LINES_PER_BOOT hard cap on lines per boot (default 40)
+    """
+
+    def __init__(self, db, boot_budget_s=None, boot_started_at=None, max_lines=None,
+                 default_line_s=45.0, startup_reserve_s=30.0, min_grace_s=30.0, max_grace_s=180.0,
+                 min_batch=1, high_failure_rate=0.5, fallback_batch=3, history_size=30):
+        self.db = db
+        self.boot_budget_s = float(boot_budget_s or os.getenv("VM_BOOT_BUDGET_S", 600))
+        self.boot_started_at = boot_started_at or self.detect_boot_time(self.boot_budget_s)
+        self.max_lines = int(max_lines or os.getenv("VM_MAX_LINES_PER_BOOT", 40))
+        self.default_line_s = default_line_s
+        self.startup_reserve_s = startup_reserve_s
+        self.min_grace_s = min_grace_s
+        self.max_grace_s = max_grace_s
+        self.min_batch = min_batch
+        self.high_failure_rate = high_failure_rate
+        self.fallback_batch = fallback_batch
+        self.history_size = history_size
+        self.logger = logging.getLogger("BatchScheduler")
+        self._estimate = None
+        self._admitted = 0
+
+    @staticmethod
+    def detect_boot_time(boot_budget_s=None):
+        """
+        When the machine booted (from /proc/uptime). If that is already more than
+        `boot_budget_s` ago, when this process started instead; falls back to now.
+        """
+        now = time.time()
+        try:
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            return now
+        if boot_budget_s is None or uptime < boot_budget_s:
+            return now - uptime
+        try:
+            # field 22 of /proc/self/stat: process start in clock ticks after boot
+            with open("/proc/self/stat") as f:
+                started_ticks = float(f.read().rsplit(")", 1)[1].split()[19])
+            return now - uptime + started_ticks / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return now
+
+    def elapsed(self):
+        return time.time() - self.boot_started_at
+
+    def remaining(self):
+        return self.boot_budget_s - self.elapsed()
+
+    def estimate(self):
+        """
+        (seconds per line, failure rate) from recent history.
+        Uses the 80th percentile of attempt durations so one slow line does not overrun the budget.
+        """
+        if self._estimate is None:
+            history = self.db.get_scrape_history(self.history_size)
+            durations = sorted(h["duration_s"] for h in history if h["duration_s"] is not None)
+            if durations:
+                line_s = durations[min(len(durations) - 1, int(len(durations) * 0.8))]
+                failure_rate = sum(1 for h in history if not h["success"]) / len(history)
+            else:
+                line_s, failure_rate = self.default_line_s, 0.0
+            self._estimate = (line_s, failure_rate)
+        return self._estimate
+
+    def batch_size(self):
+        """How many lines to claim for this boot."""
+        line_s, failure_rate = self.estimate()
+        usable = self.remaining() - self.startup_reserve_s - self.min_grace_s
+        size = int(usable // line_s) if line_s > 0 else self.max_lines
+        size = max(self.min_batch, min(size, self.max_lines))
+        if failure_rate >= self.high_failure_rate:
+            # the site is failing most lines; do not spend the whole boot (and the IP) on it
+            size = min(size, self.fallback_batch)
+        self.logger.info(
+            f"Batch size {size}: {self.remaining():.0f}s left of {self.boot_budget_s:.0f}s budget, "
+            f"~{line_s:.1f}s per line, failure rate {failure_rate:.0%}"
+        )
+        return size
+
+    def fits_another_line(self):
+        """True while one more line can finish before the grace period has to start (always for the first)."""
+        line_s, _ = self.estimate()
+        if self._admitted and self.remaining() - self.min_grace_s < line_s:
+            return False
+        self._admitted += 1
+        return True
+
+    def grace_period(self):
+        """Seconds to wait before stop_vm: whatever is left of the budget, within [min_grace_s, max_grace_s]."""
+        return max(self.min_grace_s, min(self.max_grace_s, self.remaining()))
@@ -0,0 +1,221 @@
+"""
+End-to-end pipeline benchmark against local stand-ins for Parrot and Telegram.
+
+    python -m benchmarks.bench_pipeline --lines 5 20 100 --out bench_results/pipeline.json
+
+Every "boot" of flow_main runs in its own subprocess, like a VM boot, inside a scratch
+working directory with its own database. Results are written as JSON so runs can be compared.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import sqlite3
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+
+from benchmarks.fake_services import FakeServices
+from benchmarks import synthetic_media
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from voice_backends import DEFAULT_BACKENDS
+
+
+def _boot():
+    """Entry point of one boot subprocess: run a single flow_main stage against the stand-ins."""
+    import flow_main
+    import instrumentation
+    from editor_agent import DynamicVideoEditor
+
+    placeholder = os.path.abspath(os.path.join("image_assests", "search_placeholder.png"))
+
+    def search_image(self, term):
+        # image search is an external service too; hand back a local image instead
+        with instrumentation.stage("image_search", term=term):
+            return placeholder
+
+    DynamicVideoEditor.search_image = search_image
+    try:
+        flow_main.run_flow()
+    finally:
+        instrumentation.get_instrumentation().export_prometheus()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _current_stage(db_path):
+    from db_handler import DBOperation
+    return DBOperation(db_path).get_stage_and_unprocessed_dialogues().get("stage")
+
+
+def _stage_totals(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT stage, COUNT(*), SUM(duration_s), SUM(bytes), MAX(peak_rss_bytes)
+            FROM stage_metrics GROUP BY stage ORDER BY stage;
+        """).fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+    return {
+        row[0]: {"count": row[1], "duration_s": row[2], "bytes": row[3], "peak_rss_bytes": row[4]}
+        for row in rows
+    }
+
+
+def _run_boot(workdir, env):
+    """Run one boot, returning (wall seconds, peak RSS of the boot process tree in bytes)."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", "from benchmarks.bench_pipeline import _boot; _boot()"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is kilobytes on Linux
+    peak = usage.ru_maxrss if platform.system() == "Darwin" else usage.ru_maxrss * 1024
+    return elapsed, peak, proc.returncode
+
+
+def prepare_media(media_dir, clips=6, background_seconds=75, width=1080, height=1920, kind="noise"):
+    """Build the clips the fake Parrot page serves plus the background footage (cached between sizes)."""
+    media = []
+    for i in range(clips):
+        path = os.path.join(media_dir, f"voice_{i}.mp4")
+        if not os.path.exists(path):
+            synthetic_media.make_speech_like_mp4(path, duration=1.5 + 0.4 * i, seed=i)
+        media.append(path)
+    background = os.path.join(media_dir, f"background_{kind}_{width}x{height}_{background_seconds}s.mp4")
+    if not os.path.exists(background):
+        synthetic_media.make_background_video(background, background_seconds, width, height, kind=kind)
+    return media, background
+
+
+def run_size(lines, media, background, generate_latency=0.5, max_boots=None, keep=False, voice_backends=DEFAULT_BACKENDS):
+    workdir = tempfile.mkdtemp(prefix=f"stewie_bench_{lines}_")
+    os.makedirs(os.path.join(workdir, "image_assests"), exist_ok=True)
+    for name in ("peter.png", "stewie.png"):
+        shutil.copy(os.path.join(REPO_ROOT, "image_assests", name), os.path.join(workdir, "image_assests", name))
+    synthetic_media.make_character_png(
+        os.path.join(workdir, "image_assests", "search_placeholder.png"), color=(60, 120, 220), width=500, height=350
+    )
+
+    db_path = os.path.join(workdir, "stewie_database.db")
+    output_path = os.path.join(workdir, "output_final_video.mp4")
+    script = synthetic_media.make_script(lines, seed=lines)
+    max_boots = max_boots or lines + 10
+
+    boots = []
+    with FakeServices(media, script=script, generate_latency=generate_latency) as services:
+        env = dict(os.environ)
+        env.update(services.env())
+        env.update({
+            "BACKGROUND_VIDEO_PATH": background,
+            "VOICE_BACKENDS": voice_backends,
+            # each boot is a fresh process on a long-running host; give it a VM-sized budget
+            "VM_BOOT_BUDGET_S": env.get("VM_BOOT_BUDGET_S", "600"),
+            "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        })
+        bench_start = time.perf_counter()
+        time_to_video = None
+        rendered = False
+        while len(boots) < max_boots:
+            stage = _current_stage(db_path)
+            if stage == 0 and rendered:
+                break
+            env["STEWIE_RUN_ID"] = f"bench_{lines}_boot_{len(boots)}"
+            elapsed, peak, code = _run_boot(workdir, env)
+            boots.append({"stage": stage, "seconds": elapsed, "peak_rss_bytes": peak, "exit_code": code})
+            if stage == 2:
+                rendered = True
+                if os.path.exists(output_path):
+                    time_to_video = time.perf_counter() - bench_start
+        uploads = list(services.uploads)
+
+    scrape_seconds = sum(b["seconds"] for b in boots if b["stage"] == 1)
+    result = {
+        "lines": lines,
+        "boots": len(boots),
+        "scrape_boots": sum(1 for b in boots if b["stage"] == 1),
+        "scrape_seconds": scrape_seconds,
+        "render_seconds": sum(b["seconds"] for b in boots if b["stage"] == 2),
+        "lines_per_minute": (lines / scrape_seconds * 60) if scrape_seconds else None,
+        "time_to_video_s": time_to_video,
+        "video_bytes": os.path.getsize(output_path) if os.path.exists(output_path) else None,
+        "uploaded_bytes": sum(uploads),
+        "peak_rss_bytes": max((b["peak_rss_bytes"] for b in boots), default=None),
+        "stages": _stage_totals(db_path),
+        "boot_log": boots,
+    }
+    if keep:
+        result["workdir"] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stewie pipeline benchmark against local stand-ins")
+    parser.add_argument("--lines", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--latency", type=float, default=0.5, help="fake generate latency in seconds")
+    parser.add_argument("--background", choices=["solid", "noise", "testsrc"], default="noise")
+    parser.add_argument("--background-seconds", type=int, default=75)
+    parser.add_argument("--size", default="1080x1920", help="background WxH")
+    parser.add_argument("--voice-backends", default=DEFAULT_BACKENDS,
+                        help=f"VOICE_BACKENDS for the boots (default {DEFAULT_BACKENDS!r}, the production default; "
+                             "'http,selenium' runs without Chrome)")
+    parser.add_argument("--media-dir", default=os.path.join(REPO_ROOT, "bench_media"))
+    parser.add_argument("--out", help="write JSON results here as well as to stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch working directories")
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    media, background = prepare_media(
+        args.media_dir, background_seconds=args.background_seconds, width=width, height=height, kind=args.background
+    )
+
+    report = {
+        "benchmark": "pipeline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            "latency": args.latency,
+            "background": args.background,
+            "size": args.size,
+            "voice_backends": args.voice_backends,
+            "production_backends": args.voice_backends == DEFAULT_BACKENDS,
+        },
+        "results": [
+            run_size(n, media, background, args.latency, keep=args.keep, voice_backends=args.voice_backends)
+            for n in args.lines
+        ],
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
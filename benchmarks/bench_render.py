@@ -0,0 +1,297 @@
+"""
+Render microbenchmark for DynamicVideoEditor on deterministic synthetic inputs.
+
+    python -m benchmarks.bench_render                       # run all variants, compare to baseline
+    python -m benchmarks.bench_render --save-baseline       # record the current numbers as baseline
+    python -m benchmarks.bench_render --variants solid_l3_w4 --threshold 0.05
+
+Each variant renders in its own subprocess and scratch directory. Reported per variant:
+clip construction time, encode frames/second, peak RSS, output size and how many segments
+were rendered or reused. `_b3` variants render three different scripts over the same
+background in one DynamicVideoEditor.render_batch call; compare their `encode_s_per_video`
+with the single-video variant of the same size.
+Exit code is 1 when any variant regresses past the threshold against the stored baseline.
+
+Baselines are per machine and are not committed. Timings from another CPU or size say nothing,
+so each report records `machine` and `size`, and the gate only runs when both match the
+baseline. In CI, run the benchmark on a pinned runner type: the first run (or a run on the
+default branch) does --save-baseline and caches benchmarks/baselines/render.json, and each
+later run restores that file and compares with --require-baseline, so a missing or
+mismatched baseline fails the job instead of passing silently.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+
+from benchmarks import synthetic_media
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BASELINE_PATH = os.path.join(REPO_ROOT, "benchmarks", "baselines", "render.json")
+FPS = 24
+SECONDS_PER_WORD = 0.25
+
+# metric -> True when lower is better, False when higher is better
+GATED_METRICS = {
+    "clip_build_s": True,
+    "encode_s": True,
+    "encode_fps": False,
+    "peak_rss_bytes": True,
+}
+
+
+def build_variants():
+    variants = {}
+    for background in ("solid", "noise"):
+        for lines in (3, 10, 20):
+            for words in (4, 12):
+                name = f"{background}_l{lines}_w{words}"
+                variants[name] = {"name": name, "background": background, "lines": lines, "words": words}
+        name = f"{background}_l10_w4_b3"
+        variants[name] = {"name": name, "background": background, "lines": 10, "words": 4, "videos": 3}
+    return variants
+
+
+VARIANTS = build_variants()
+
+
+def machine_info():
+    """What the timings depend on; a baseline is only compared against a report with the same values."""
+    return {
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def _prepare_workdir(variant, media_dir, width, height):
+    workdir = tempfile.mkdtemp(prefix=f"stewie_render_{variant['name']}_")
+    for folder in ("audio_assests", "image_assests"):
+        os.makedirs(os.path.join(workdir, folder), exist_ok=True)
+
+    synthetic_media.make_character_png(os.path.join(workdir, "image_assests", "peter.png"), color=(220, 60, 60))
+    synthetic_media.make_character_png(os.path.join(workdir, "image_assests", "stewie.png"), color=(60, 200, 90))
+    synthetic_media.make_character_png(
+        os.path.join(workdir, "image_assests", "search_placeholder.png"), color=(60, 120, 220), width=500, height=350
+    )
+
+    jobs = []
+    for video in range(variant.get("videos", 1)):
+        # a different script per video; ids are offset so every line has its own audio file
+        script = synthetic_media.make_script(variant["lines"], words_per_line=variant["words"],
+                                             seed=variant["lines"] + video)
+        dialogue_data = []
+        for idx, line in enumerate(script, start=1 + 1000 * video):
+            character = line["character"].lower()
+            words = len(line["dialogue"].split(":", 1)[1].split())
+            synthetic_media.make_tone_audio(
+                os.path.join(workdir, "audio_assests", f"{character}_audio_{idx}.mp3"),
+                duration=0.3 + SECONDS_PER_WORD * words,
+                freq=220 + 20 * (idx % 12),
+            )
+            dialogue_data.append({
+                "id": idx,
+                "sentence": line["dialogue"],
+                "character": line["character"],
+                "image": line["image"],
+                "image_search": line["image_search"],
+                "audio_processed": 1,
+                "audio_process_retry": 1,
+            })
+        jobs.append(dialogue_data)
+
+    # the editor keeps seconds 10-60 of the background
+    background = os.path.join(media_dir, f"render_bg_{variant['background']}_{width}x{height}.mp4")
+    if not os.path.exists(background):
+        synthetic_media.make_background_video(background, 70, width, height, fps=FPS, kind=variant["background"])
+
+    with open(os.path.join(workdir, "job.json"), "w") as f:
+        json.dump({"variant": variant, "background": background, "jobs": jobs}, f)
+    return workdir
+
+
+def _render_child(workdir):
+    """Runs inside the variant subprocess."""
+    os.chdir(workdir)
+    os.environ["STEWIE_RUN_ID"] = "render_bench"
+    import instrumentation
+    from editor_agent import DynamicVideoEditor
+
+    with open("job.json") as f:
+        job = json.load(f)
+
+    placeholder = os.path.abspath(os.path.join("image_assests", "search_placeholder.png"))
+    DynamicVideoEditor.search_image = lambda self, term: placeholder
+
+    if len(job["jobs"]) == 1:
+        with instrumentation.stage("clip_build", step="editor_init"):
+            editor = DynamicVideoEditor(video_path=job["background"], output_path=os.path.abspath("bench_output.mp4"),
+                                        dialogue_data=job["jobs"][0])
+        editor.edit()
+        editors = [editor]
+    else:
+        editors = DynamicVideoEditor.render_batch(job["background"], [
+            (os.path.abspath(f"bench_output_{video}.mp4"), dialogue_data)
+            for video, dialogue_data in enumerate(job["jobs"])
+        ])
+
+    metrics = instrumentation.get_instrumentation()
+    conn = metrics.connect()
+    try:
+        encode_labels = [json.loads(row[0] or "{}") for row in conn.execute(
+            "SELECT labels FROM stage_metrics WHERE run_id = ? AND stage = 'encode';", (metrics.run_id,)
+        )]
+    finally:
+        conn.close()
+    with open("result.json", "w") as f:
+        json.dump({
+            "stages": metrics.get_run_summary(),
+            "frames": sum(int(labels.get("frames", 0)) for labels in encode_labels),
+            "output_bytes": sum(os.path.getsize(editor.output_path) for editor in editors),
+            "rendered_segments": sum(editor.rendered_segments for editor in editors),
+            "reused_segments": sum(editor.cached_segments for editor in editors),
+        }, f)
+
+
+def run_variant(variant, media_dir, width, height, keep=False):
+    workdir = _prepare_workdir(variant, media_dir, width, height)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    stderr_path = os.path.join(workdir, "stderr.log")
+    with open(stderr_path, "wb") as stderr_file:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_render", "--child", workdir],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=stderr_file,
+        )
+        _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = exit_code = os.waitstatus_to_exitcode(status)
+    with open(stderr_path, "rb") as f:
+        stderr = f.read().decode("utf-8", "replace")
+
+    result = {"variant": variant["name"], "config": variant, "exit_code": exit_code}
+    result_path = os.path.join(workdir, "result.json")
+    if exit_code != 0 or not os.path.exists(result_path):
+        result["error"] = stderr[-2000:]
+    else:
+        with open(result_path) as f:
+            child = json.load(f)
+        stages = child["stages"]
+        encode_s = stages.get("encode", {}).get("duration_s") or 0
+        frames = child["frames"]
+        videos = variant.get("videos", 1)
+        result.update({
+            "clip_build_s": stages.get("clip_build", {}).get("duration_s"),
+            "encode_s": encode_s,
+            "encode_s_per_video": encode_s / videos,
+            "frames": frames,
+            "encode_fps": frames / encode_s if encode_s else None,
+            "peak_rss_bytes": usage.ru_maxrss if platform.system() == "Darwin" else usage.ru_maxrss * 1024,
+            "output_bytes": child["output_bytes"],
+            "rendered_segments": child["rendered_segments"],
+            "reused_segments": child["reused_segments"],
+        })
+    if keep:
+        result["workdir"] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Flag gated metrics that got worse than baseline by more than `threshold` (a fraction)."""
+    regressions = []
+    base_by_name = {r["variant"]: r for r in baseline.get("results", [])}
+    for result in results:
+        base = base_by_name.get(result["variant"])
+        if not base or "error" in result:
+            continue
+        for metric, lower_is_better in GATED_METRICS.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if lower_is_better else change < -threshold
+            if worse:
+                regressions.append({"variant": result["variant"], "metric": metric, "baseline": old, "current": new, "change": change})
+        if base.get("output_bytes") and result.get("output_bytes"):
+            result["output_bytes_change"] = (result["output_bytes"] - base["output_bytes"]) / base["output_bytes"]
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DynamicVideoEditor render microbenchmark")
+    parser.add_argument("--variants", nargs="+", choices=sorted(VARIANTS), help="defaults to all variants")
+    parser.add_argument("--size", default="1080x1920", help="background WxH")
+    parser.add_argument("--media-dir", default=os.path.join(REPO_ROOT, "bench_media"))
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown, e.g. 0.10 = 10%%")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="fail when there is no baseline for this machine and size instead of skipping the gate")
+    parser.add_argument("--out", help="write JSON results here as well as to stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch working directories")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _render_child(args.child)
+        return None
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    os.makedirs(args.media_dir, exist_ok=True)
+    names = args.variants or sorted(VARIANTS)
+    results = [run_variant(VARIANTS[name], args.media_dir, width, height, keep=args.keep) for name in names]
+
+    report = {
+        "benchmark": "render",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": machine_info(),
+        "size": args.size,
+        "threshold": args.threshold,
+        "results": results,
+    }
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        report["regressions"] = []
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline.get("machine"), baseline.get("size")) == (report["machine"], report["size"]):
+            report["regressions"] = compare(results, baseline, args.threshold)
+        else:
+            report["regressions"] = []
+            report["baseline_mismatch"] = {"machine": baseline.get("machine"), "size": baseline.get("size")}
+            print(f"Baseline at {args.baseline} is from another machine or size; not comparing.", file=sys.stderr)
+    else:
+        report["regressions"] = []
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one.", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+    no_baseline = args.require_baseline and not args.save_baseline and (
+        "baseline_mismatch" in report or not os.path.exists(args.baseline)
+    )
+    failed = report["regressions"] or no_baseline or any("error" in r for r in results)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+PARROT_PAGE = """<!doctype html>
+<html>
+<head><title>{title}</title></head>
+<body>
+  <textarea id="text" rows="4" cols="60"></textarea>
+  <button id="generate">Generate</button>
+  <div id="player"></div>
+  <script>
+    document.getElementById("generate").addEventListener("click", function () {{
+      fetch("/api/generate", {{
+        method: "POST",
+        headers: {{"Content-Type": "application/json"}},
+        body: JSON.stringify({{voice: "{voice}", text: document.getElementById("text").value}})
+      }})
+        .then(function (r) {{ return r.json(); }})
+        .then(function (data) {{
+          var video = document.createElement("video");
+          document.getElementById("player").appendChild(video);
+          video.setAttribute("src", data.url);
+        }});
+    }});
+  </script>
+</body>
+</html>
+"""
+
+
+class FakeServices:
+    """
+    Local stand-in for tryparrotai.com and the Telegram Bot API, served from one port.
+
+    Parrot:
+        GET  /ai-voice/<voice>        page with a textarea, a Generate button and a <video src>
+        POST /api/generate            {"voice", "text"} -> {"url": <local mp4>} after `generate_latency`,
+                                      or with async_generate=True -> {"id", "status": "pending", "status_url"}
+        GET  /api/status/<id>         {"status": "pending"} until `generate_latency` has passed, then
+                                      {"status": "done", "url": <local mp4>}
+        GET  /media/<file>.mp4        pre-generated speech-like clips
+    Telegram:
+        /bot<token>/getUpdates        hands out `script` once as a "from: [...]" message
+        /bot<token>/sendMessage       accepted and recorded
+        /bot<token>/sendDocument      accepted, upload size recorded
+    """
+
+    def __init__(self, media_files, script=None, generate_latency=0.5, async_generate=False, host="127.0.0.1", port=0):
+        self.media_files = list(media_files)
+        self.script = script
+        self.generate_latency = generate_latency
+        self.async_generate = async_generate
+        self.jobs = {}  # job id -> (ready_at, url)
+        self.generate_requests = []
+        self.messages = []
+        self.uploads = []
+        self.generate_calls = 0
+        self._lock = threading.Lock()
+        self._script_delivered = False
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def env(self, token="bench-token", chat_id="1"):
+        """Environment variables that point the pipeline at this server."""
+        return {
+            "PARROT_BASE_URL": self.base_url,
+            "TELEGRAM_API_BASE": self.base_url,
+            "TELEGRAM_BOT_TOKEN": token,
+            "TELEGRAM_CHAT_ID": chat_id,
+        }
+
+    # ---- handlers -----------------------------------------------------
+
+    def _next_media_url(self):
+        with self._lock:
+            index = self.generate_calls % len(self.media_files)
+            self.generate_calls += 1
+        return f"{self.base_url}/media/{os.path.basename(self.media_files[index])}"
+
+    def _updates(self, offset):
+        if self.script is None or self._script_delivered or (offset is not None and offset > 1):
+            return []
+        self._script_delivered = True
+        text = "from: " + json.dumps(self.script)
+        return [{"update_id": 1, "message": {"message_id": 1, "text": text}}]
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body)
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _bot(self, method, query, body):
+                if method == "getUpdates":
+                    offset = query.get("offset", [None])[0]
+                    offset = int(offset) if offset not in (None, "", "None") else None
+                    return self._send(200, {"ok": True, "result": services._updates(offset)})
+                if method == "sendMessage":
+                    services.messages.append(body.decode("utf-8", "replace"))
+                    return self._send(200, {"ok": True, "result": {}})
+                if method == "sendDocument":
+                    services.uploads.append(len(body))
+                    return self._send(200, {"ok": True, "result": {}})
+                return self._send(404, {"ok": False, "description": "unknown method"})
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                path = parsed.path
+                bot = re.match(r"^/bot[^/]*/(\w+)$", path)
+                if bot:
+                    return self._bot(bot.group(1), parse_qs(parsed.query), b"")
+                voice = re.match(r"^/ai-voice/([\w-]+)$", path)
+                if voice:
+                    page = PARROT_PAGE.format(title=voice.group(1), voice=voice.group(1))
+                    return self._send(200, page, "text/html; charset=utf-8")
+                status = re.match(r"^/api/status/(\d+)$", path)
+                if status:
+                    job = services.jobs.get(int(status.group(1)))
+                    if job is None:
+                        return self._send(404, {"error": "unknown job"})
+                    if time.time() < job[0]:
+                        return self._send(200, {"status": "pending"})
+                    return self._send(200, {"status": "done", "url": job[1]})
+                media = re.match(r"^/media/([\w.-]+)$", path)
+                if media:
+                    for file_path in services.media_files:
+                        if os.path.basename(file_path) == media.group(1):
+                            with open(file_path, "rb") as f:
+                                return self._send(200, f.read(), "video/mp4")
+                return self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                body = self._body()
+                bot = re.match(r"^/bot[^/]*/(\w+)$", parsed.path)
+                if bot:
+                    return self._bot(bot.group(1), parse_qs(parsed.query), body)
+                if parsed.path == "/api/generate":
+                    try:
+                        services.generate_requests.append(json.loads(body or b"{}"))
+                    except ValueError:
+                        return self._send(400, {"error": "bad json"})
+                    if services.async_generate:
+                        url = services._next_media_url()
+                        with services._lock:
+                            job_id = len(services.jobs) + 1
+                            services.jobs[job_id] = (time.time() + services.generate_latency, url)
+                        return self._send(200, {"id": job_id, "status": "pending", "status_url": f"/api/status/{job_id}"})
+                    time.sleep(services.generate_latency)
+                    return self._send(200, {"url": services._next_media_url()})
+                return self._send(404, {"error": "not found"})
+
+        return Handler
@@ -0,0 +1,115 @@
+"""
+Multi-process check of the dialogue leases on one SQLite file.
+
+    python -m benchmarks.lease_check --workers 4 --rows 200
+
+Every worker process claims batches from the same database (get_stage_and_unprocessed_dialogues
+with a worker_id) and marks what it got as processed, until no line is left. Then a late result
+is written for a line whose lease expired and was claimed by another worker.
+Exit code is 1 when two workers were handed the same line, a line was never claimed or the
+late result overwrote the other worker's claim.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from db_handler import DBOperation
+
+
+def _claim_all(db_path, worker_id, batch, start_at):
+    """Runs inside a worker process: claims and marks lines until none are left. Returns the claimed ids."""
+    db = DBOperation(db_path)
+    claimed = []
+    # all workers start claiming at the same moment
+    time.sleep(max(0.0, start_at - time.time()))
+    while True:
+        stage_data = db.get_stage_and_unprocessed_dialogues(limit=batch, worker_id=worker_id, lease_s=60)
+        if stage_data.get("stage") != 1:
+            return claimed
+        if not stage_data["dialogues"]:
+            # the rest is leased to other workers; they mark it soon
+            time.sleep(0.01)
+            continue
+        for row in stage_data["dialogues"]:
+            claimed.append(row["id"])
+            db.mark_processed(row["id"], True, asset={"path": f"audio/{row['id']}.mp3"}, worker_id=worker_id)
+
+
+def check_claims(db_path, workers, rows, batch):
+    db = DBOperation(db_path)
+    db.add_dialogues([{"dialogue": f"Peter: line {i}", "character": "Peter"} for i in range(rows)])
+    start_at = time.time() + 1.0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_claim_all, db_path, f"worker-{n}", batch, start_at) for n in range(workers)]
+        claims = {f"worker-{n}": future.result() for n, future in enumerate(futures)}
+
+    counts = Counter(dialogue_id for ids in claims.values() for dialogue_id in ids)
+    conn = sqlite3.connect(db_path)
+    try:
+        all_ids = {row[0] for row in conn.execute("SELECT id FROM dialouge_stage;")}
+    finally:
+        conn.close()
+    return {
+        "claims_per_worker": {worker: len(ids) for worker, ids in claims.items()},
+        "duplicates": sorted(dialogue_id for dialogue_id, count in counts.items() if count > 1),
+        "never_claimed": sorted(all_ids - set(counts)),
+    }
+
+
+def check_late_result(db_path):
+    """A worker whose lease ran out must not overwrite the row once another worker has claimed it."""
+    db = DBOperation(db_path)
+    db.truncate_dialouge_stage()
+    db.add_dialogues([{"dialogue": "Stewie: late line", "character": "Stewie"}])
+    dialogue_id = db.get_stage_and_unprocessed_dialogues(limit=1, worker_id="slow", lease_s=0.05)["dialogues"][0]["id"]
+    time.sleep(0.1)
+    db.get_stage_and_unprocessed_dialogues(limit=1, worker_id="fresh", lease_s=60)
+    late_written = db.mark_processed(dialogue_id, False, failure_kind="unknown", worker_id="slow")
+    conn = sqlite3.connect(db_path)
+    try:
+        owner, retries = conn.execute(
+            "SELECT lease_owner, audio_process_retry FROM dialouge_stage WHERE id = ?;", (dialogue_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return {"late_result_written": late_written, "lease_owner": owner, "retries": retries}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-process check of the dialogue leases")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=3, help="lines claimed per call, like the batch scheduler")
+    parser.add_argument("--db", help="defaults to a fresh file in a temporary directory")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="stewie_leases_"), "leases.db")
+    report = {
+        "db": db_path,
+        "workers": args.workers,
+        "rows": args.rows,
+        "claims": check_claims(db_path, args.workers, args.rows, args.batch),
+        "late_result": check_late_result(db_path),
+    }
+    print(json.dumps(report, indent=2))
+
+    late = report["late_result"]
+    failed = (
+        report["claims"]["duplicates"] or report["claims"]["never_claimed"]
+        or late["late_result_written"] or late["lease_owner"] != "fresh" or late["retries"] != 0
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import random
+import subprocess
+
+
+def ffmpeg_binary():
+    """Same ffmpeg moviepy uses, so benchmarks and renders agree on codecs."""
+    try:
+        from moviepy.config import get_setting
+        return get_setting("FFMPEG_BINARY")
+    except Exception:
+        pass
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+
+def run_ffmpeg(args):
+    cmd = [ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error"] + args
+    subprocess.run(cmd, check=True)
+
+
+def speech_like_expression(duration, seed=0):
+    """
+    aevalsrc expression that sounds roughly like speech to a silence detector:
+    a harmonic carrier chopped into ~4 syllables/second, loud enough to sit well above -40 dBFS.
+    """
+    rng = random.Random(seed)
+    pitch = rng.uniform(110, 240)
+    rate = rng.uniform(3.0, 5.0)
+    carrier = f"(sin(2*PI*{pitch:.1f}*t)+0.5*sin(2*PI*{2 * pitch:.1f}*t)+0.25*sin(2*PI*{3 * pitch:.1f}*t))"
+    envelope = f"(0.55+0.45*sin(2*PI*{rate:.2f}*t))"
+    return f"0.35*{carrier}*{envelope}*lt(t,{duration:.3f})"
+
+
+def make_speech_like_mp4(path, duration=2.5, seed=0, lead_silence=0.8, tail_silence=0.8, size="320x240"):
+    """MP4 like the ones the Parrot page returns: a still frame plus speech-like audio padded with silence."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    total = lead_silence + duration + tail_silence
+    delay_ms = int(lead_silence * 1000)
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"color=c=black:s={size}:d={total:.3f}:r=10",
+        "-f", "lavfi", "-i", f"aevalsrc='{speech_like_expression(duration, seed)}':s=44100:d={duration:.3f}",
+        "-filter_complex", f"[1:a]adelay={delay_ms}|{delay_ms},apad=whole_dur={total:.3f}[a]",
+        "-map", "0:v", "-map", "[a]",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", path,
+    ])
+    return path
+
+
+def make_tone_audio(path, duration=2.0, freq=440.0, sample_rate=44100):
+    """Deterministic sine tone; the container is picked from the file extension."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"sine=frequency={freq}:sample_rate={sample_rate}:duration={duration:.3f}",
+        path,
+    ])
+    return path
+
+
+def make_background_video(path, duration=60, width=1080, height=1920, fps=24, kind="noise"):
+    """
+    Synthetic gameplay footage.
+    kind: "solid" (cheap to decode), "noise" (worst case for the encoder) or "testsrc" (moving pattern).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    size = f"{width}x{height}"
+    if kind == "solid":
+        source = f"color=c=0x2a4d69:s={size}:d={duration}:r={fps}"
+    elif kind == "testsrc":
+        source = f"testsrc2=s={size}:d={duration}:r={fps}"
+    else:
+        source = f"color=c=gray:s={size}:d={duration}:r={fps},noise=alls=40:allf=t+u"
+    run_ffmpeg([
+        "-f", "lavfi", "-i", source,
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-an", path,
+    ])
+    return path
+
+
+def make_character_png(path, color=(220, 60, 60), width=400, height=600):
+    """Transparent PNG with a filled ellipse, standing in for peter.png / stewie.png."""
+    from PIL import Image, ImageDraw
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse([width * 0.1, height * 0.05, width * 0.9, height * 0.95], fill=tuple(color) + (255,))
+    image.save(path)
+    return path
+
+
+WORDS = (
+    "time complexity memory cache thread queue python index query scale data "
+    "loop stack heap graph tree hash socket server client build deploy test"
+).split()
+
+
+def make_script(lines, words_per_line=10, seed=0):
+    """Peter/Stewie script in the same shape the Telegram bot accepts."""
+    rng = random.Random(seed)
+    script = []
+    for i in range(lines):
+        character = "Peter" if i % 2 == 0 else "Stewie"
+        sentence = " ".join(rng.choice(WORDS) for _ in range(words_per_line)).capitalize()
+        # the scraper skips anything over 100 characters
+        sentence = sentence[:95].rsplit(" ", 1)[0] + "."
+        script.append({
+            "image": f"{character.lower()}.png",
+            "dialogue": f"{character}: {sentence}",
+            "character": character,
+            "image_search": " ".join(rng.sample(WORDS, 2)),
+        })
+    return script
@@ -0,0 +1,212 @@
+import bisect
+import numpy as np
+
+
+class Overlay:
+    """
+    A still RGBA image shown at a fixed position from `start` for `duration` seconds.
+
+    `source` is either an (h, w, 4) uint8 array or a zero-argument callable returning one;
+    callables are only invoked when the overlay becomes active, so long scripts do not keep
+    every image in memory for the whole render.
+    `position` accepts the same forms moviepy does: (x, y) with ints or "left"/"center"/"right"
+    and "top"/"center"/"bottom".
+    Fades follow moviepy's fadein/fadeout: the colour fades to black, the alpha stays.
+    `key` identifies the image content (used by the editor's segment cache).
+    """
+
+    def __init__(self, source, position, start, duration, fadein=0.0, fadeout=0.0, layer=0, key=None):
+        self.source = source
+        self.key = key
+        self.position = position
+        self.start = float(start)
+        self.duration = float(duration)
+        self.end = self.start + self.duration
+        self.fadein = fadein
+        self.fadeout = fadeout
+        self.layer = layer
+        # filled in by FrameCompositor while the overlay is active
+        self.prepared = None
+
+    def describe(self, offset=0.0):
+        """Everything that decides how this overlay looks, with times relative to `offset`."""
+        return [self.key, list(self.position), round(self.start - offset, 6), round(self.duration, 6),
+                self.fadein, self.fadeout]
+
+    def load(self):
+        return self.source() if callable(self.source) else self.source
+
+    def fade_factor(self, t):
+        local = t - self.start
+        factor = 1.0
+        if self.fadein and local < self.fadein:
+            factor = min(factor, local / self.fadein)
+        if self.fadeout and self.duration - local < self.fadeout:
+            factor = min(factor, (self.duration - local) / self.fadeout)
+        return max(0.0, factor)
+
+
+class _Prepared:
+    """Per-overlay blend data: cropped to the visible, non-transparent area of the frame."""
+
+    __slots__ = ("y0", "y1", "x0", "x1", "rgb", "premul", "inv_alpha", "opaque")
+
+    def __init__(self, y0, y1, x0, x1, rgb, premul, inv_alpha, opaque):
+        self.y0, self.y1, self.x0, self.x1 = y0, y1, x0, x1
+        self.rgb = rgb
+        self.premul = premul
+        self.inv_alpha = inv_alpha
+        self.opaque = opaque
+
+
+class IntervalIndex:
+    """
+    Overlays sorted by start time. Frames are requested in increasing t while encoding, so
+    `active(t)` sweeps forward and only touches overlays entering or leaving; seeking backwards
+    falls back to a bisect over the start times.
+    """
+
+    def __init__(self, overlays):
+        self.items = sorted(overlays, key=lambda o: (o.start, o.layer))
+        self.starts = [o.start for o in self.items]
+        self.reset()
+
+    def reset(self):
+        self._next = 0
+        self._active = []
+        self._last_t = float("-inf")
+
+    def active(self, t):
+        """Returns (active overlays in layer order, overlays that just stopped being active)."""
+        retired = []
+        if t < self._last_t:
+            retired = self._active
+            self.reset()
+        self._last_t = t
+
+        stop = bisect.bisect_right(self.starts, t)
+        changed = False
+        while self._next < stop:
+            overlay = self.items[self._next]
+            self._next += 1
+            if overlay.end > t:
+                self._active.append(overlay)
+                changed = True
+
+        still_active = []
+        for overlay in self._active:
+            if overlay.end > t:
+                still_active.append(overlay)
+            else:
+                retired.append(overlay)
+        if changed or len(still_active) != len(self._active):
+            still_active.sort(key=lambda o: o.layer)
+        self._active = still_active
+        return still_active, retired
+
+
+class FrameCompositor:
+    """
+    Composites overlays on top of a background clip into one reused frame buffer.
+
+    Only the overlays active at t are blended (see IntervalIndex), and every blend is integer
+    math on uint8/uint16 buffers allocated once, so per-frame cost depends on what is on screen
+    rather than on script length.
+    """
+
+    def __init__(self, background, overlays, size=None):
+        self.background = background
+        self.width, self.height = size or background.size
+        self.index = IntervalIndex(overlays)
+        self.duration = max([o.end for o in overlays] + [0.0])
+        self._frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self._scratch = np.empty((self.height, self.width, 3), dtype=np.uint16)
+        self._scratch2 = np.empty((self.height, self.width, 3), dtype=np.uint16)
+
+    def resolve_position(self, position, w, h):
+        x, y = position
+        if isinstance(x, str):
+            x = {"left": 0, "center": (self.width - w) // 2, "right": self.width - w}[x]
+        if isinstance(y, str):
+            y = {"top": 0, "center": (self.height - h) // 2, "bottom": self.height - h}[y]
+        return int(x), int(y)
+
+    def _prepare(self, overlay):
+        rgba = overlay.load()
+        h, w = rgba.shape[:2]
+        x, y = self.resolve_position(overlay.position, w, h)
+
+        # crop to the fully transparent margins and to the frame bounds
+        alpha = rgba[..., 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if rows.size == 0:
+            return None
+        top, bottom = max(rows[0], -y), min(rows[-1] + 1, self.height - y)
+        left, right = max(cols[0], -x), min(cols[-1] + 1, self.width - x)
+        if top >= bottom or left >= right:
+            return None
+
+        rgba = rgba[top:bottom, left:right]
+        alpha = rgba[..., 3:4]
+        opaque = bool((alpha == 255).all())
+        rgb = np.ascontiguousarray(rgba[..., :3])
+        premul = inv_alpha = None
+        if not opaque:
+            alpha16 = alpha.astype(np.uint16)
+            premul = rgb.astype(np.uint16) * alpha16
+            inv_alpha = 255 - alpha16
+        return _Prepared(y + top, y + bottom, x + left, x + right, rgb, premul, inv_alpha, opaque)
+
+    def _blend(self, prepared, fade):
+        region = self._frame[prepared.y0:prepared.y1, prepared.x0:prepared.x1]
+        h, w = region.shape[:2]
+
+        if prepared.opaque:
+            if fade >= 1.0:
+                np.copyto(region, prepared.rgb)
+            else:
+                np.multiply(prepared.rgb, fade, out=region, casting="unsafe")
+            return
+
+        acc = self._scratch[:h, :w]
+        tmp = self._scratch2[:h, :w]
+        # acc = bg * (255 - a) + fg * a * fade, at most 255 * 255
+        np.multiply(region, prepared.inv_alpha, out=acc)
+        if fade >= 1.0:
+            acc += prepared.premul
+        else:
+            np.multiply(prepared.premul, fade, out=tmp, casting="unsafe")
+            acc += tmp
+        # exact rounded division by 255 without leaving uint16
+        acc += 128
+        np.right_shift(acc, 8, out=tmp)
+        acc += tmp
+        acc >>= 8
+        np.copyto(region, acc, casting="unsafe")
+
+    def make_frame(self, t):
+        if self.background.duration is not None and t >= self.background.duration:
+            # same as CompositeVideoClip once the background has ended: black behind the overlays
+            return self.compose(t, None)
+        return self.compose(t, self.background.get_frame(t))
+
+    def compose(self, t, background_frame):
+        """
+        The frame at t drawn over an already decoded background frame (None for black), so one
+        decoded frame can be shared by several compositors.
+        """
+        if background_frame is None:
+            self._frame.fill(0)
+        else:
+            np.copyto(self._frame, background_frame, casting="unsafe")
+
+        active, retired = self.index.active(t)
+        for overlay in retired:
+            overlay.prepared = None
+        for overlay in active:
+            if overlay.prepared is None:
+                overlay.prepared = self._prepare(overlay) or False
+            if overlay.prepared:
+                self._blend(overlay.prepared, overlay.fade_factor(t))
+        return self._frame
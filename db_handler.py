@@ -1,12 +1,26 @@
+import os
+import socket
 import sqlite3
+import time
 
 class DBOperation:
     def __init__(self, db_name="stewie_database.db"):
         self.db_name = db_name
         self.create_dialouge_stage_table()
+        self.ensure_dialouge_stage_columns()
+        self.create_scrape_history_table()
+        self.create_circuit_breaker_table()
+
+    # several workers may share one database file; wait for a busy writer instead of failing
+    BUSY_TIMEOUT_S = 30
 
     def connect(self):
-        return sqlite3.connect(self.db_name)
+        return sqlite3.connect(self.db_name, timeout=self.BUSY_TIMEOUT_S)
+
+    @staticmethod
+    def default_worker_id():
+        """WORKER_ID if set, else <hostname>:<pid>."""
+        return os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
 
     def create_dialouge_stage_table(self):
         query = """
@@ -17,7 +31,15 @@ class DBOperation:
             image TEXT,
             image_search TEXT,
             audio_processed INTEGER DEFAULT 0,
-            audio_process_retry INTEGER DEFAULT 0
+            audio_process_retry INTEGER DEFAULT 0,
+            next_eligible_at REAL,
+            last_failure TEXT,
+            audio_path TEXT,
+            audio_duration_ms INTEGER,
+            audio_sample_rate INTEGER,
+            audio_bytes INTEGER,
+            lease_owner TEXT,
+            lease_expires_at REAL
         );
         """
         try:
@@ -32,6 +54,139 @@ class DBOperation:
             conn.close()
 
 
+    # columns added after the first release; older databases get them via ALTER TABLE
+    DIALOUGE_STAGE_EXTRA_COLUMNS = {
+        "next_eligible_at": "REAL",
+        "last_failure": "TEXT",
+        "audio_path": "TEXT",
+        "audio_duration_ms": "INTEGER",
+        "audio_sample_rate": "INTEGER",
+        "audio_bytes": "INTEGER",
+        "lease_owner": "TEXT",
+        "lease_expires_at": "REAL",
+    }
+
+    def ensure_dialouge_stage_columns(self):
+        """Adds any missing columns to an existing dialouge_stage table."""
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            existing = {row[1] for row in cursor.execute("PRAGMA table_info(dialouge_stage);")}
+            for column, column_type in self.DIALOUGE_STAGE_EXTRA_COLUMNS.items():
+                if column not in existing:
+                    cursor.execute(f"ALTER TABLE dialouge_stage ADD COLUMN {column} {column_type};")
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error during column migration: {e}")
+        finally:
+            conn.close()
+
+    def create_scrape_history_table(self):
+        """
+        One row per scrape attempt. Kept across scripts (not truncated) so the batch
+        scheduler can learn how long a line takes and how often it fails.
+        """
+        query = """
+        CREATE TABLE IF NOT EXISTS scrape_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dialogue_id INTEGER,
+            started_at REAL,
+            duration_s REAL,
+            success INTEGER
+        );
+        """
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute(query)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error during table creation: {e}")
+        finally:
+            conn.close()
+
+    def record_scrape(self, dialogue_id, started_at, duration_s, success):
+        """Stores the outcome and duration of one scrape attempt."""
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO scrape_history (dialogue_id, started_at, duration_s, success)
+                VALUES (?, ?, ?, ?);
+            """, (dialogue_id, started_at, duration_s, 1 if success else 0))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error while recording scrape: {e}")
+        finally:
+            conn.close()
+
+    def get_scrape_history(self, limit=50):
+        """Most recent scrape attempts, newest first: [{"duration_s", "success"}, ...]"""
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT duration_s, success FROM scrape_history
+                ORDER BY id DESC LIMIT ?;
+            """, (limit,))
+            return [{"duration_s": row[0], "success": bool(row[1])} for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"SQLite error while reading scrape history: {e}")
+            return []
+        finally:
+            conn.close()
+
+
+    def create_circuit_breaker_table(self):
+        query = """
+        CREATE TABLE IF NOT EXISTS circuit_breaker (
+            page TEXT PRIMARY KEY,
+            consecutive_failures INTEGER DEFAULT 0,
+            opened_until REAL
+        );
+        """
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute(query)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error during table creation: {e}")
+        finally:
+            conn.close()
+
+    def get_circuit(self, page):
+        """Breaker state for a speaker page: {"consecutive_failures", "opened_until"}"""
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute("SELECT consecutive_failures, opened_until FROM circuit_breaker WHERE page = ?;", (page,))
+            row = cursor.fetchone()
+            if row:
+                return {"consecutive_failures": row[0] or 0, "opened_until": row[1]}
+        except sqlite3.Error as e:
+            print(f"SQLite error while reading circuit state: {e}")
+        finally:
+            conn.close()
+        return {"consecutive_failures": 0, "opened_until": None}
+
+    def save_circuit(self, page, consecutive_failures, opened_until):
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO circuit_breaker (page, consecutive_failures, opened_until) VALUES (?, ?, ?)
+                ON CONFLICT(page) DO UPDATE SET
+                    consecutive_failures = excluded.consecutive_failures,
+                    opened_until = excluded.opened_until;
+            """, (page, consecutive_failures, opened_until))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error while saving circuit state: {e}")
+        finally:
+            conn.close()
+
+
     def add_dialogues(self, dialogues):
             """
             Adds a list of dialogues to the dialouge_stage table.
@@ -72,35 +227,55 @@ class DBOperation:
                 conn.close()
 
 
-    def get_stage_and_unprocessed_dialogues(self):
+    def get_stage_and_unprocessed_dialogues(self, limit=3, worker_id=None, lease_s=300):
         """
-        Returns stage and up to 3 unprocessed dialogues (if exist):
+        Returns stage and up to `limit` unprocessed dialogues (if exist), retries first, oldest first:
         {
             "stage": 0 → table empty
                     1 → unprocessed dialogues exist
+                        (dialogues is [] while they are all waiting out a retry backoff
+                         or leased by other workers)
                     2 → table has data, but no eligible dialogues
             "dialogues": [...] or None
         }
+        With `worker_id`, the returned dialogues are leased to that worker for `lease_s` seconds
+        in the same transaction, so concurrent workers never get the same row. Leases that have
+        expired (a worker that died) are claimable again.
             """
         try:
             conn = self.connect()
+            # explicit transactions: BEGIN IMMEDIATE takes the write lock before reading
+            conn.isolation_level = None
             cursor = conn.cursor()
+            now = time.time()
+            if worker_id:
+                cursor.execute("BEGIN IMMEDIATE;")
 
             # Check if table is empty
             cursor.execute("SELECT COUNT(*) FROM dialouge_stage;")
             total_rows = cursor.fetchone()[0]
             if total_rows == 0:
+                if worker_id:
+                    cursor.execute("COMMIT;")
                 return {"stage": 0, "dialogues": None}
 
-            # Try to fetch up to 3 unprocessed dialogues
+            # Try to fetch up to `limit` unprocessed dialogues, lines that already failed go first
             cursor.execute("""
                 SELECT id, sentence, character, image, image_search, audio_processed, audio_process_retry
                 FROM dialouge_stage
                 WHERE audio_processed = 0 AND audio_process_retry < 5
-                ORDER BY id ASC
-                LIMIT 3;
-            """)
+                  AND (next_eligible_at IS NULL OR next_eligible_at <= ?)
+                  AND (lease_owner IS NULL OR lease_expires_at <= ? OR lease_owner = ?)
+                ORDER BY audio_process_retry > 0 DESC, id ASC
+                LIMIT ?;
+            """, (now, now, worker_id, limit))
             rows = cursor.fetchall()
+            if worker_id:
+                cursor.executemany(
+                    "UPDATE dialouge_stage SET lease_owner = ?, lease_expires_at = ? WHERE id = ?;",
+                    [(worker_id, now + lease_s, row[0]) for row in rows],
+                )
+                cursor.execute("COMMIT;")
             if rows:
                 dialogues = []
                 for row in rows:
@@ -115,20 +290,72 @@ class DBOperation:
                     })
                 return {"stage": 1, "dialogues": dialogues}
 
+            # Unprocessed dialogues that are still backing off (or leased by another worker) keep us in stage 1
+            cursor.execute("""
+                SELECT COUNT(*) FROM dialouge_stage
+                WHERE audio_processed = 0 AND audio_process_retry < 5;
+            """)
+            if cursor.fetchone()[0] > 0:
+                return {"stage": 1, "dialogues": []}
+
             # Table has data, but no unprocessed dialogue
             return {"stage": 2, "dialogues": None}
 
         except sqlite3.Error as e:
             print(f"SQLite error: {e}")
+            if conn.in_transaction:
+                conn.rollback()
             return {"stage": -1, "dialogues": None}  # Error flag
         finally:
             conn.close()
 
+    def renew_leases(self, worker_id, dialogue_ids, lease_s=300):
+        """Extends this worker's leases on `dialogue_ids`. Returns the ids it still holds."""
+        if not dialogue_ids:
+            return set()
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            placeholders = ",".join("?" for _ in dialogue_ids)
+            cursor.execute(f"""
+                UPDATE dialouge_stage SET lease_expires_at = ?
+                WHERE lease_owner = ? AND id IN ({placeholders});
+            """, (time.time() + lease_s, worker_id, *dialogue_ids))
+            conn.commit()
+            cursor.execute(f"""
+                SELECT id FROM dialouge_stage WHERE lease_owner = ? AND id IN ({placeholders});
+            """, (worker_id, *dialogue_ids))
+            return {row[0] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"SQLite error while renewing leases: {e}")
+            return set()
+        finally:
+            conn.close()
 
+    def release_leases(self, worker_id, dialogue_ids=None):
+        """Gives back this worker's leases (all of them when dialogue_ids is None)."""
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            query = "UPDATE dialouge_stage SET lease_owner = NULL, lease_expires_at = NULL WHERE lease_owner = ?"
+            params = [worker_id]
+            if dialogue_ids is not None:
+                query += f" AND id IN ({','.join('?' for _ in dialogue_ids)})"
+                params.extend(dialogue_ids)
+            cursor.execute(query + ";", params)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error while releasing leases: {e}")
+        finally:
+            conn.close()
 
 
     def get_raedy_assests(self):
-  
+        """
+        Render manifest: processed dialogues in order, each with the audio clip recorded by
+        mark_processed (audio_path, audio_duration_ms, audio_sample_rate, audio_bytes).
+        Rows processed before the manifest existed have those keys set to None.
+        """
         try:
             conn = self.connect()
             cursor = conn.cursor()
@@ -141,7 +368,8 @@ class DBOperation:
 
             # Try to fetch up to 3 unprocessed dialogues
             cursor.execute("""
-                SELECT id, sentence, character, image, image_search, audio_processed, audio_process_retry
+                SELECT id, sentence, character, image, image_search, audio_processed, audio_process_retry,
+                       audio_path, audio_duration_ms, audio_sample_rate, audio_bytes
                 FROM dialouge_stage
                 WHERE audio_processed = 1 ORDER BY id ASC;
             """)
@@ -156,7 +384,11 @@ class DBOperation:
                         "image": row[3],
                         "image_search": row[4],
                         "audio_processed": row[5],
-                        "audio_process_retry": row[6]
+                        "audio_process_retry": row[6],
+                        "audio_path": row[7],
+                        "audio_duration_ms": row[8],
+                        "audio_sample_rate": row[9],
+                        "audio_bytes": row[10]
                     })
                 return dialogues
 
@@ -170,37 +402,58 @@ class DBOperation:
 
 
 
-    def mark_processed(self, dialogue_id, flag):
+    def mark_processed(self, dialogue_id, flag, failure_kind=None, next_eligible_at=None, give_up=False, asset=None,
+                       worker_id=None):
             """
             Marks a dialogue as processed based on the flag:
-            If flag is True, set audio_processed to 1 and increment audio_process_retry.
-            If flag is False, just increment audio_process_retry.
+            If flag is True, set audio_processed to 1 and increment audio_process_retry, and store the
+            produced clip from `asset` ({"path", "duration_ms", "sample_rate", "bytes"}) on the row.
+            If flag is False, increment audio_process_retry and record why it failed and when it
+            may be retried (next_eligible_at, epoch seconds). give_up=True exhausts the retries.
+            With `worker_id`, the row is only updated while no other worker holds its lease.
+            Returns True when the row was updated.
             """
+            # a late result must not overwrite a row another worker has claimed since
+            owned = " AND (lease_owner IS NULL OR lease_owner = ?)" if worker_id else ""
+            owner = (worker_id,) if worker_id else ()
+            updated = False
             try:
                 conn = self.connect()
                 cursor = conn.cursor()
 
                 if flag:
                     # If flag is True, set audio_processed to 1 and increment retry count
-                    cursor.execute("""
+                    asset = asset or {}
+                    cursor.execute(f"""
                         UPDATE dialouge_stage
-                        SET audio_processed = 1, audio_process_retry = audio_process_retry + 1
-                        WHERE id = ?;
-                    """, (dialogue_id,))
+                        SET audio_processed = 1, audio_process_retry = audio_process_retry + 1,
+                            next_eligible_at = NULL, last_failure = NULL,
+                            lease_owner = NULL, lease_expires_at = NULL,
+                            audio_path = ?, audio_duration_ms = ?, audio_sample_rate = ?, audio_bytes = ?
+                        WHERE id = ?{owned};
+                    """, (asset.get("path"), asset.get("duration_ms"), asset.get("sample_rate"),
+                          asset.get("bytes"), dialogue_id, *owner))
                 else:
-                    # If flag is False, just increment retry count
-                    cursor.execute("""
+                    # If flag is False, bump the retry count and schedule the next attempt
+                    cursor.execute(f"""
                         UPDATE dialouge_stage
-                        SET audio_process_retry = audio_process_retry + 1
-                        WHERE id = ?;
-                    """, (dialogue_id,))
+                        SET audio_process_retry = CASE WHEN ? THEN 5 ELSE audio_process_retry + 1 END,
+                            next_eligible_at = ?, last_failure = ?,
+                            lease_owner = NULL, lease_expires_at = NULL
+                        WHERE id = ?{owned};
+                    """, (1 if give_up else 0, next_eligible_at, failure_kind, dialogue_id, *owner))
 
+                updated = cursor.rowcount > 0
                 conn.commit()
-                print(f"Dialogue with ID {dialogue_id} has been updated.")
+                if updated:
+                    print(f"Dialogue with ID {dialogue_id} has been updated.")
+                else:
+                    print(f"Dialogue with ID {dialogue_id} is leased by another worker, not updated.")
             except sqlite3.Error as e:
                 print(f"SQLite error during update: {e}")
             finally:
                 conn.close()
+            return updated
 
 
     def show_all_dialogues(self):
@@ -0,0 +1,71 @@
+import wave
+import numpy as np
+from pydub import AudioSegment
+
+
+class DialogueTrack:
+    """
+    The whole dialogue as one contiguous PCM buffer.
+
+    Each line is decoded once, converted to a common sample rate / channel count, optionally
+    loudness-normalised, and placed at its sample offset with `gap` seconds of silence between
+    lines. Start times come from sample offsets, so subtitles line up with the audio exactly.
+
+    When the duration of a line is already known (asset manifest), `add` only reserves its
+    place; the file is decoded when the track is written and padded/trimmed to that length.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, gap=0.5, normalize_dbfs=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.gap = gap
+        self.gap_samples = int(round(gap * sample_rate))
+        self.normalize_dbfs = normalize_dbfs
+        self.segments = []  # (offset in samples, length in samples, int16 (n, channels) array or None, path)
+        self.length = 0
+
+    def decode(self, audio_path):
+        segment = AudioSegment.from_file(audio_path)
+        segment = segment.set_frame_rate(self.sample_rate).set_channels(self.channels).set_sample_width(2)
+        if self.normalize_dbfs is not None and segment.dBFS != float("-inf"):
+            segment = segment.apply_gain(self.normalize_dbfs - segment.dBFS)
+        samples = np.array(segment.get_array_of_samples(), dtype=np.int16)
+        return samples.reshape(-1, self.channels)
+
+    def add(self, audio_path, duration_s=None):
+        """Append a line after the previous one. Returns (start, duration) in seconds."""
+        samples = None
+        if duration_s is None:
+            samples = self.decode(audio_path)
+            length = len(samples)
+        else:
+            length = int(round(duration_s * self.sample_rate))
+        offset = self.length + (self.gap_samples if self.segments else 0)
+        self.segments.append((offset, length, samples, audio_path))
+        self.length = offset + length
+        return offset / self.sample_rate, length / self.sample_rate
+
+    def placed(self):
+        """Yields (offset, samples) per line, decoding lines that were only reserved."""
+        for offset, length, samples, audio_path in self.segments:
+            if samples is None:
+                samples = self.decode(audio_path)[:length]
+                if len(samples) < length:
+                    samples = np.pad(samples, ((0, length - len(samples)), (0, 0)))
+            yield offset, samples
+
+    @property
+    def duration(self):
+        return self.length / self.sample_rate
+
+    def write_wav(self, path):
+        """Write the mixed track as 16-bit PCM WAV (used when muxing the final video)."""
+        track = np.zeros((self.length, self.channels), dtype=np.int16)
+        for offset, samples in self.placed():
+            track[offset:offset + len(samples)] = samples
+        with wave.open(path, "wb") as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(track.tobytes())
+        return path
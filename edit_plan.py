@@ -0,0 +1,110 @@
+import os
+import json
+
+
+class PlanError(Exception):
+    """The dialogue rows cannot be turned into a valid timeline. `problems` lists every reason."""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("; ".join(self.problems))
+
+
+class EditPlan:
+    """
+    The compiled edit decision list: everything a render backend needs, and nothing decoded.
+
+    `clips` is a list of dicts in drawing order (later visual clips are drawn on top):
+        {"type": "audio", "id", "path", "start", "duration"}
+        {"type": "image", "id", "path", "height", "position", "start", "duration"}
+        {"type": "text", "id", "text", "position", "start", "duration", "fadein", "fadeout"}
+    Times are seconds on the output timeline. `background` is
+    {"path", "start", "end", "size", "duration"} and `duration` is the length of the output.
+
+    Plans are plain JSON, so they can be stored, compared (`diff`) and rendered later.
+    """
+
+    VERSION = 1
+
+    def __init__(self, background, fps, gap, duration, clips):
+        self.background = background
+        self.fps = fps
+        self.gap = gap
+        self.duration = duration
+        self.clips = clips
+
+    def to_dict(self):
+        return {
+            "version": self.VERSION,
+            "background": self.background,
+            "fps": self.fps,
+            "gap": self.gap,
+            "duration": self.duration,
+            "clips": self.clips,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != cls.VERSION:
+            raise PlanError([f"Plan version {data.get('version')} is not {cls.VERSION}"])
+        return cls(data["background"], data["fps"], data["gap"], data["duration"], data["clips"])
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True, indent=1)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def validate(self):
+        """
+        Checks the plan can be rendered without opening anything: every referenced file exists,
+        every clip has a positive duration and the background has footage. Dialogue longer
+        than the footage is allowed; the renderer draws it over black.
+        Raises PlanError listing every problem.
+        """
+        problems = []
+        if not os.path.exists(self.background["path"]):
+            problems.append(f"Background video not found: {self.background['path']}")
+        for clip in self.clips:
+            label = f"{clip['type']} clip for dialogue ID {clip.get('id')}"
+            if "path" in clip and not os.path.exists(clip["path"]):
+                problems.append(f"{label}: file not found: {clip['path']}")
+            if not clip["duration"] > 0:
+                problems.append(f"{label}: duration {clip['duration']} is not positive")
+        if not self.background["duration"] > 0:
+            problems.append(f"Background video has no footage after {self.background['start']}s")
+        if problems:
+            raise PlanError(problems)
+        return self
+
+    def diff(self, other):
+        """Human-readable differences from an `other` (older) plan, one string per change."""
+        changes = []
+        for field in ("background", "fps", "gap", "duration"):
+            if getattr(self, field) != getattr(other, field):
+                changes.append(f"{field}: {getattr(other, field)} -> {getattr(self, field)}")
+
+        def by_line(plan):
+            lines = {}
+            for clip in plan.clips:
+                lines.setdefault(clip.get("id"), []).append(clip)
+            return lines
+
+        old, new = by_line(other), by_line(self)
+        for line_id in sorted(set(old) | set(new), key=str):
+            if line_id not in new:
+                changes.append(f"dialogue ID {line_id}: removed")
+            elif line_id not in old:
+                changes.append(f"dialogue ID {line_id}: added")
+            elif old[line_id] != new[line_id]:
+                fields = sorted({
+                    key
+                    for before, after in zip(old[line_id], new[line_id])
+                    for key in set(before) | set(after)
+                    if before.get(key) != after.get(key)
+                })
+                if len(old[line_id]) != len(new[line_id]):
+                    fields.append("clips")
+                changes.append(f"dialogue ID {line_id}: {', '.join(fields)} changed")
+        return changes
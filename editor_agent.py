@@ -1,34 +1,128 @@
-from moviepy.editor import (
-    VideoFileClip,
-    AudioFileClip,
-    CompositeAudioClip,
-    CompositeVideoClip,
-    ImageClip,
-    TextClip,
-)
+# the submodules, not moviepy.editor, which also loads every effect and preview helper
+from moviepy.video.io.VideoFileClip import VideoFileClip
+from moviepy.video.VideoClip import TextClip
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
 from PIL import Image
+import numpy as np
 from duckduckgo_search import DDGS
 import requests
 import os
+import json
+import math
+import hashlib
 import random
+import subprocess
+from collections import OrderedDict
+import instrumentation
+from compositor import FrameCompositor, Overlay
+from dialogue_track import DialogueTrack
+from edit_plan import EditPlan, PlanError
+from artifact_store import ArtifactStore
+from utils import Utils
 
 from moviepy.config_defaults import IMAGEMAGICK_BINARY
 #IMAGEMAGICK_BINARY = r"/usr/bin/convert"   chnage this path to  your  imagemagick file path
 
+
+class RenderCancelled(Exception):
+    """Raised by edit() when the cancel event is set before the final render is done."""
+
 class DynamicVideoEditor:
-    def __init__(self, video_path, output_path, dialogue_data):
+    FPS = 24
+    BACKGROUND_START = 10
+    BACKGROUND_END = 60
+    # bump whenever the way frames are drawn changes, so stale segments are not reused
+    RENDER_VERSION = 1
+    RENDER_PROFILE = {"codec": "libx264", "preset": "medium", "fps": FPS}
+    # decoded images / rendered subtitle words kept for reuse, least recently used dropped first
+    IMAGE_CACHE_SIZE = 8
+    WORD_CACHE_SIZE = 48
+    # quick look sent before the final render: every PREVIEW_STEP-th pixel at PREVIEW_FPS
+    PREVIEW_STEP = int(os.getenv("PREVIEW_STEP", 4))
+    PREVIEW_FPS = int(os.getenv("PREVIEW_FPS", 8))
+
+    def __init__(self, video_path, output_path, dialogue_data, normalize_dbfs=None, store=None, background=None):
         self.video_path = video_path
         self.output_path = output_path
         self.dialogue_data = dialogue_data
-        self.audio_clips = []
+        # every line is decoded once into a single pre-mixed track
+        self.dialogue_track = DialogueTrack(gap=0.5, normalize_dbfs=normalize_dbfs)
         self.image_clips = []
         self.subtitle_clips = []
-        self.current_start = 0
-    
-        self.video = VideoFileClip(video_path).subclip(10, 60)
+        self.line_starts = []
+        self._image_cache = OrderedDict()
+        self._word_cache = OrderedDict()
+        self._content_keys = {}
+        # search images and rendered segments (under "render/<key>") live in the artifact store
+        self.store = store or ArtifactStore()
+        self.rendered_segments = 0
+        self.cached_segments = 0
+        # the mixed dialogue as WAV, written once for the preview and the final mux
+        self._wav_path = None
+        # opened on first use, so a plan with missing files fails before the video is probed
+        self._video = background
+
+    @property
+    def video(self):
+        if self._video is None:
+            self._video = self.open_background(self.video_path)
+        return self._video
+
+    @classmethod
+    def open_background(cls, video_path, min_duration=0.0):
+        """
+        The background from BACKGROUND_START, normally up to BACKGROUND_END. When the dialogue
+        needs `min_duration` seconds the window is extended as far as the file allows.
+        """
+        clip = VideoFileClip(video_path)
+        end = min(clip.duration, max(cls.BACKGROUND_END, cls.BACKGROUND_START + min_duration))
+        return clip.subclip(cls.BACKGROUND_START, end)
+
+    def content_key(self, path):
+        """sha256 of a file's bytes, computed once per path."""
+        if path not in self._content_keys:
+            self._content_keys[path] = Utils.file_sha256(path)
+        return self._content_keys[path]
+
+    @staticmethod
+    def _cached(cache, key, limit, build):
+        """LRU lookup: returns cache[key], building it on a miss and evicting beyond `limit` entries."""
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = cache[key] = build()
+        while len(cache) > limit:
+            cache.popitem(last=False)
+        return value
+
+    def load_image_rgba(self, path, height):
+        """Image resized to `height` as an RGBA uint8 array (what ImageClip(...).resize(height=...) shows)."""
+        def build():
+            with Image.open(path) as img:
+                img = img.convert("RGBA")
+                width = max(1, round(img.width * height / img.height))
+                return np.asarray(img.resize((width, height), Image.LANCZOS))
+        return self._cached(self._image_cache, (path, height), self.IMAGE_CACHE_SIZE, build)
+
+    def render_word_rgba(self, word):
+        """Subtitle word rendered through ImageMagick, reused while it stays in the word cache."""
+        def build():
+            clip = TextClip(word, fontsize=95, color='yellow', font='DejaVu-Sans-Bold', stroke_color="black", stroke_width=0.3)
+            rgb = clip.get_frame(0)
+            mask = clip.mask.get_frame(0) if clip.mask is not None else np.ones(rgb.shape[:2])
+            alpha = np.round(mask * 255).astype(np.uint8)
+            clip.close()
+            return np.dstack([rgb.astype(np.uint8), alpha])
+        return self._cached(self._word_cache, word, self.WORD_CACHE_SIZE, build)
 
     def search_image(self, term):
-        with DDGS() as ddgs:
+        ref = f"image_search/{term.replace(' ', '_')}.jpg"
+        cached = self.store.resolve(ref)
+        if cached:
+            # already fetched by an earlier (possibly crashed) render
+            return cached
+        with instrumentation.stage("image_search", term=term) as span, DDGS() as ddgs:
             search_results = ddgs.images(keywords=term)
             image_data = list(search_results)
             image_urls = [item.get("image") for item in image_data[:1]]
@@ -36,11 +130,8 @@ class DynamicVideoEditor:
                 url = image_urls[0]
                 print(f"Downloading image for '{term}': {url}")
                 img_data = requests.get(url).content
-                os.makedirs("downloaded_images", exist_ok=True)
-                img_name = f"downloaded_images/{term.replace(' ', '_')}.jpg"
-                with open(img_name, 'wb') as img_file:
-                    img_file.write(img_data)
-                return img_name
+                span.bytes = len(img_data)
+                return self.store.put_bytes(img_data, ".jpg", name=ref)
         return None
 
     def create_title_clip(self, text, duration):
@@ -57,90 +148,470 @@ class DynamicVideoEditor:
             .set_position(("center", "center"))
         )
 
-    def add_word_by_word_subtitles(self, text, start_time, duration):
+    def add_word_by_word_subtitles(self, text, start_time, duration, dialogue_id=None):
+        """Plan clips showing `text` one word at a time over the line."""
         words = text.split()
         word_duration = duration / len(words)
         word_clips = []
 
         current_time = start_time
         for word in words:
-            clip = (
-                TextClip(word, fontsize=95, color='yellow', font='DejaVu-Sans-Bold', stroke_color="black", stroke_width=0.3)
-                .set_start(current_time)
-                .set_duration(word_duration)
-                .set_position(("center", "center"))
-                .fadein(0.1)
-                .fadeout(0.1)
-            )
-            word_clips.append(clip)
+            word_clips.append({
+                "type": "text",
+                "id": dialogue_id,
+                "text": word,
+                "position": ["center", "center"],
+                "start": current_time,
+                "duration": word_duration,
+                "fadein": 0.1,
+                "fadeout": 0.1,
+            })
             current_time += word_duration
         return word_clips
 
-    def edit(self):
-        #title_clip = self.create_title_clip(self.title, duration=self.video.duration)
+    @staticmethod
+    def audio_asset(item):
+        """
+        (audio path, duration in seconds or None) for a manifest row from get_raedy_assests.
+        Rows without a recorded clip fall back to the file name VoiceGenerator writes,
+        which uses the speaker prefix of the line rather than the character column.
+        """
+        if item.get("audio_path"):
+            duration_ms = item.get("audio_duration_ms")
+            return item["audio_path"], duration_ms / 1000 if duration_ms else None
+        speaker = item["sentence"].split(":", 1)[0].strip().lower()
+        return f"audio_assests/{speaker}_audio_{item['id']}.mp3", None
+
+    def edit(self, on_preview=None, cancel=None):
+        """
+        Compiles and validates the edit plan (raises PlanError before anything is decoded), then
+        renders the video to `output_path`. With `on_preview`, a small low-fps preview is rendered
+        right after the timeline is laid out and passed to on_preview(path) before the final render
+        starts. `cancel` is a threading.Event; once it is set the final render stops with
+        RenderCancelled.
+        """
+        edl = self.compile_plan()
+        self.save_plan(edl)
+        compositor, duration = self.build_timeline(edl)
+        if on_preview:
+            on_preview(self.render_preview(compositor, duration))
+        plan = self.plan_segments(compositor, duration)
+        try:
+            self.render_segments(compositor, plan, cancel=cancel)
+        except RenderCancelled:
+            # segments finished so far stay in the store for a later render
+            self.discard_wav()
+            raise
+        self.finish(plan)
+
+    @property
+    def preview_path(self):
+        root, ext = os.path.splitext(self.output_path)
+        return f"{root}_preview{ext}"
+
+    def render_preview(self, compositor, duration):
+        """
+        Renders the whole timeline at 1/PREVIEW_STEP of the resolution and PREVIEW_FPS, with the
+        dialogue audio, to `preview_path`. Good enough to check pacing and image choices.
+        """
+        frames = int(math.ceil(duration * self.PREVIEW_FPS - 1e-6))
+        step = max(1, self.PREVIEW_STEP)
+        # libx264 needs even dimensions
+        height = (len(range(0, compositor.height, step)) // 2) * 2
+        width = (len(range(0, compositor.width, step)) // 2) * 2
+        video_path = self.store.tmp_path("preview.mp4")
+        with instrumentation.stage("preview", frames=frames) as span:
+            writer = FFMPEG_VideoWriter(video_path, (width, height), self.PREVIEW_FPS,
+                                        codec="libx264", preset="ultrafast")
+            try:
+                for frame_index in range(frames):
+                    frame = compositor.make_frame(frame_index / self.PREVIEW_FPS)
+                    writer.write_frame(np.ascontiguousarray(frame[::step, ::step][:height, :width]))
+            finally:
+                writer.close()
+            compositor.index.reset()
+            if os.path.lexists(self.preview_path):
+                os.remove(self.preview_path)
+            try:
+                self.ffmpeg(["-i", video_path, "-i", self.dialogue_wav(),
+                             "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-b:a", "64k",
+                             self.preview_path])
+            finally:
+                os.remove(video_path)
+            span.bytes = os.path.getsize(self.preview_path)
+        return self.preview_path
+
+    def dialogue_wav(self):
+        """The dialogue track as a WAV scratch file, decoded and written only once."""
+        if self._wav_path is None:
+            self._wav_path = self.dialogue_track.write_wav(self.store.tmp_path("dialogue.wav"))
+        return self._wav_path
+
+    @staticmethod
+    def ffmpeg(args):
+        subprocess.run([get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error"] + args, check=True)
+
+    @classmethod
+    def render_batch(cls, video_path, jobs, normalize_dbfs=None, store=None):
+        """
+        Render several scripts over the same background video in one pass.
+        `jobs` is [(output_path, dialogue_data), ...]; returns one editor per job.
+
+        Each background frame is decoded once and composited into every video that needs it,
+        and each video's segments stream into their own ffmpeg encoder at the same time.
+        Segments already in the store, or shared between jobs, are rendered once.
+        """
+        store = store or ArtifactStore()
+        editors = [
+            cls(video_path, output_path, dialogue_data, normalize_dbfs=normalize_dbfs, store=store)
+            for output_path, dialogue_data in jobs
+        ]
+        # every job's files are checked before the background is opened
+        problems, checked = [], []
+        for editor in editors:
+            try:
+                checked.append(editor.check_assets())
+            except PlanError as e:
+                problems.extend(f"{editor.output_path}: {problem}" for problem in e.problems)
+        if problems:
+            raise PlanError(problems)
 
+        # one background long enough for the longest script
+        layouts = [editor.layout_audio(lines) for editor, lines in zip(editors, checked)]
+        background = cls.open_background(video_path, max(track_duration for _, track_duration in layouts))
+        planned, work, scheduled = [], [], set()
+        for editor, layout in zip(editors, layouts):
+            editor._video = background
+            edl = editor.compile_plan(layout)
+            editor.save_plan(edl)
+            compositor, duration = editor.build_timeline(edl)
+            plan = editor.plan_segments(compositor, duration)
+            planned.append((editor, plan))
+            for segment in plan:
+                if segment[4] is not None:
+                    continue
+                if segment[3] in scheduled:
+                    # another job in this batch renders it
+                    editor.cached_segments += 1
+                else:
+                    scheduled.add(segment[3])
+                    work.append((editor, compositor, segment))
+
+        if work:
+            frames = sum(segment[2] - segment[1] for _, _, segment in work)
+            with instrumentation.stage("encode", videos=len(jobs), frames=frames) as span:
+                cls._render_shared(background, work)
+                span.bytes = sum(os.path.getsize(segment[4]) for _, _, segment in work)
+
+        for editor, plan in planned:
+            for segment in plan:
+                if segment[4] is None:
+                    # rendered for another job in this batch
+                    segment[4] = store.resolve(segment[3])
+            editor.finish(plan)
+        return [editor for editor, _ in planned]
+
+    @classmethod
+    def _render_shared(cls, background, work):
+        """Sweeps the frame range once, fanning each decoded background frame out to every open segment."""
+        pending = sorted(work, key=lambda w: w[2][1])
+        open_segments = []
+        frame_index = pending[0][2][1]
+        try:
+            while pending or open_segments:
+                if not open_segments and pending[0][2][1] > frame_index:
+                    # nothing needs the frames in between
+                    frame_index = pending[0][2][1]
+                while pending and pending[0][2][1] == frame_index:
+                    editor, compositor, segment = pending.pop(0)
+                    open_segments.append((editor, compositor, segment) + editor.open_segment_writer(compositor, segment))
+
+                t = frame_index / cls.FPS
+                background_frame = background.get_frame(t) if t < background.duration else None
+                still_open = []
+                for editor, compositor, segment, writer, tmp_path in open_segments:
+                    writer.write_frame(compositor.compose(t, background_frame))
+                    if frame_index + 1 == segment[2]:
+                        writer.close()
+                        segment[4] = editor.store.put_file(tmp_path, name=segment[3], keep=False)
+                        editor.rendered_segments += 1
+                    else:
+                        still_open.append((editor, compositor, segment, writer, tmp_path))
+                open_segments = still_open
+                frame_index += 1
+        finally:
+            for _, _, _, writer, _ in open_segments:
+                writer.close()
+
+    def check_assets(self):
+        """
+        The (row, audio path, audio duration, image path) of every line, after checking that the
+        background and every line's files exist. Raises PlanError listing every problem; nothing
+        is opened.
+        """
+        problems, lines = [], []
+        if self._video is None and not os.path.exists(self.video_path):
+            problems.append(f"Background video not found: {self.video_path}")
+        if not isinstance(self.dialogue_data, list) or not self.dialogue_data:
+            # get_raedy_assests returns None when every line was given up on
+            raise PlanError(problems + ["No dialogue lines are ready to edit"])
         for item in self.dialogue_data:
-            audio_path = f"audio_assests/{item['character'].lower()}_audio_{item['id']}.mp3"
+            audio_path, audio_duration = self.audio_asset(item)
             #audio_path=r'C:\Users\HP\Desktop\stewie_v1\audio_assests\peter_audio_2.mp3'
             image_path = f"image_assests/{item['image']}"
+            for kind, path in (("audio", audio_path), ("image", image_path)):
+                if not os.path.exists(path):
+                    problems.append(f"Dialogue ID {item['id']}: {kind} file not found: {path}")
+            if not item["sentence"].split():
+                problems.append(f"Dialogue ID {item['id']}: empty sentence")
+            lines.append((item, audio_path, audio_duration, image_path))
+        if problems:
+            raise PlanError(problems)
+        return lines
 
-            subtitle_text = item["sentence"]
-            search_term = item.get("image_search", "")
-
-            # Load and position audio
-            audio = AudioFileClip(audio_path).set_start(self.current_start)
-            self.audio_clips.append(audio)
+    def layout_audio(self, lines):
+        """
+        Places every line of check_assets() on the dialogue timeline. Returns
+        ([(row, audio clip, image path)], track duration). Only lines without a manifest
+        duration are decoded, to measure them.
+        """
+        # start times come from the same sample arithmetic the real track uses
+        track = DialogueTrack(self.dialogue_track.sample_rate, self.dialogue_track.channels,
+                              gap=self.dialogue_track.gap)
+        placed = []
+        for item, audio_path, audio_duration, image_path in lines:
+            if audio_duration is None:
+                audio_duration = len(self.dialogue_track.decode(audio_path)) / track.sample_rate
+            start, line_duration = track.add(audio_path, audio_duration)
+            audio_clip = {"type": "audio", "id": item["id"], "path": audio_path, "start": start, "duration": line_duration}
+            placed.append((item, audio_clip, image_path))
+        return placed, track.duration
 
-            # Position character image
-            char_position = "left" if "peter" in image_path.lower() else "right"
-            if image_path:
-                char_image = (
-                    ImageClip(image_path)
-                    .set_start(self.current_start)
-                    .set_duration(audio.duration)
-                    .resize(height=500)
-                    
-                )
+    def compile_plan(self, layout=None):
+        """
+        Compiles the dialogue rows into an EditPlan: where every clip goes and for how long,
+        without decoding any image or video frame. Missing files fail first (check_assets),
+        then the lines are placed, the background is probed for its size and length and the
+        image searches run.
+        """
+        layout = layout or self.layout_audio(self.check_assets())
+        placed, track_duration = layout
+        with instrumentation.stage("plan", lines=len(placed)):
+            if self._video is None:
+                self._video = self.open_background(self.video_path, track_duration)
+            audio_clips, image_clips, subtitle_clips = [], [], []
+            for item, audio_clip, image_path in placed:
+                audio_clips.append(audio_clip)
+                start, line_duration = audio_clip["start"], audio_clip["duration"]
 
+                # Position character image (only the header is read for its size)
+                char_position = "left" if "peter" in image_path.lower() else "right"
+                with Image.open(image_path) as img:
+                    char_width = max(1, round(img.width * 500 / img.height))
                 y_position = max(0, self.video.h - 500 - 50)
+                x_position = 50 if char_position == "left" else max(0, self.video.w - char_width - 50)
+                image_clips.append({"type": "image", "id": item["id"], "path": image_path, "height": 500,
+                                    "position": [x_position, y_position], "start": start, "duration": line_duration})
 
- 
-                x_position = 50 if char_position == "left" else max(0, self.video.w - char_image.w - 50)
+                # Subtitle
+                subtitle_clips.extend(self.add_word_by_word_subtitles(item["sentence"], start, line_duration, item["id"]))
 
-  
-                char_image = char_image.set_position((x_position, y_position))
-                self.image_clips.append(char_image)
+                # Optional: Related image search
+                try:
+                    relevant_image = self.search_image(item.get("image_search", ""))
+                    if relevant_image:
+                        image_clips.append({"type": "image", "id": item["id"], "path": relevant_image, "height": 350,
+                                            "position": ["center", 300], "start": start, "duration": line_duration})
+                except Exception as e:
+                    print(f"Image search failed: {e}")
+
+            # end_clip = self.create_end_title_clip("Like, Share, thanks for watching.")
+
+            clips = audio_clips + image_clips + subtitle_clips
+            duration = max([self.video.duration, track_duration] + [c["start"] + c["duration"] for c in clips])
+            if track_duration > self.video.duration:
+                # same as before plans existed: black behind the overlays once the footage ends
+                print(f"Dialogue runs {track_duration:.2f}s but {self.video_path} only has "
+                      f"{self.video.duration:.2f}s of footage; the rest has a black background")
+            background = {
+                "path": self.video_path,
+                "start": self.BACKGROUND_START,
+                "end": self.BACKGROUND_START + self.video.duration,
+                "size": list(self.video.size),
+                "duration": self.video.duration,
+            }
+            return EditPlan(background, self.FPS, self.dialogue_track.gap, duration, clips).validate()
+
+    def save_plan(self, edl):
+        """Keeps the plan under "plan/<output name>.json" in the store and logs what changed since the last one."""
+        ref = f"plan/{os.path.basename(self.output_path)}.json"
+        previous = self.store.resolve(ref)
+        if previous:
+            with open(previous) as f:
+                try:
+                    changes = edl.diff(EditPlan.from_json(f.read()))
+                except (ValueError, KeyError, PlanError):
+                    changes = ["previous plan unreadable"]
+            print(f"Plan changes since the last render: {changes or 'none'}")
+        self.store.put_bytes(edl.to_json().encode("utf-8"), ".json", name=ref)
+
+    def build_timeline(self, edl):
+        """Turns a validated EditPlan into overlays and the dialogue track. Returns (compositor, duration)."""
+        #title_clip = self.create_title_clip(self.title, duration=self.video.duration)
 
-            # Subtitle
-            subtitle_clips = self.add_word_by_word_subtitles(subtitle_text, self.current_start, audio.duration)
-            self.subtitle_clips.extend(subtitle_clips)
+        with instrumentation.stage("clip_build", step="timeline", clips=len(edl.clips)):
+            for clip in edl.clips:
+                if clip["type"] == "audio":
+                    # with a known duration nothing is decoded until the track is mixed
+                    start, _ = self.dialogue_track.add(clip["path"], clip["duration"])
+                    self.line_starts.append(start)
+                elif clip["type"] == "image":
+                    # decoded only while the line is on screen
+                    self.image_clips.append(Overlay(
+                        lambda path=clip["path"], height=clip["height"]: self.load_image_rgba(path, height),
+                        tuple(clip["position"]),
+                        clip["start"],
+                        clip["duration"],
+                        key=f"image:{self.content_key(clip['path'])}:{clip['height']}",
+                    ))
+                elif clip["type"] == "text":
+                    self.subtitle_clips.append(Overlay(
+                        lambda word=clip["text"]: self.render_word_rgba(word),
+                        tuple(clip["position"]),
+                        clip["start"],
+                        clip["duration"],
+                        fadein=clip["fadein"],
+                        fadeout=clip["fadeout"],
+                        key=f"word:{clip['text']}",
+                    ))
 
-            # Optional: Related image search
+        with instrumentation.stage("clip_build", step="composite"):
+            overlays = self.image_clips + self.subtitle_clips
+            for layer, overlay in enumerate(overlays):
+                overlay.layer = layer
+            compositor = FrameCompositor(self.video, overlays)
+        return compositor, edl.duration
+
+    def finish(self, plan):
+        """Joins the rendered segments and adds the audio."""
+        print(f"Rendered {self.rendered_segments} segments, reused {self.cached_segments} already rendered")
+        with instrumentation.stage("encode", step="mux", frames=0) as span:
+            self.mux([segment[4] for segment in plan])
+            span.bytes = os.path.getsize(self.output_path)
+
+    def segment_bounds(self, total_frames):
+        """Frame indices where segments start: one segment per dialogue line, plus the tail."""
+        bounds = {0, total_frames}
+        for start in self.line_starts:
+            bounds.add(min(total_frames, int(round(start * self.FPS))))
+        return sorted(bounds)
+
+    def segment_key(self, compositor, first, last):
+        """
+        Hash of everything that decides the pixels of frames [first, last): render settings,
+        the background file and where in it the segment starts, where the footage ends if the
+        segment runs past it, and every overlay on screen (times relative to the segment start).
+        The background plays continuously, so the key depends on the absolute start: a line
+        whose length changes moves every later segment onto other footage.
+        """
+        t0, t1 = first / self.FPS, last / self.FPS
+        on_screen = [o for o in compositor.index.items if o.start < t1 and o.end > t0]
+        on_screen.sort(key=lambda o: o.layer)
+        background = os.path.abspath(self.video_path)
+        # only segments that reach the black tail depend on how long the window is
+        footage_end = round(self.video.duration, 6) if t1 > self.video.duration else None
+        payload = {
+            "version": self.RENDER_VERSION,
+            "profile": self.RENDER_PROFILE,
+            "size": [compositor.width, compositor.height],
+            "background": [background, os.path.getsize(background), int(os.path.getmtime(background)),
+                           self.BACKGROUND_START, footage_end],
+            "first_frame": first,
+            "frames": last - first,
+            "overlays": [o.describe(offset=t0) for o in on_screen],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def plan_segments(self, compositor, duration):
+        """
+        [index, first frame, end frame, store ref, path] per segment; path is the cached
+        segment, or None if it still has to be rendered.
+        """
+        bounds = self.segment_bounds(int(math.ceil(duration * self.FPS - 1e-6)))
+        plan = []
+        for index, (first, last) in enumerate(zip(bounds, bounds[1:])):
+            ref = f"render/{self.segment_key(compositor, first, last)}.mp4"
+            path = self.store.resolve(ref)
+            if path:
+                self.cached_segments += 1
+            plan.append([index, first, last, ref, path])
+        return plan
+
+    def render_segments(self, compositor, plan, cancel=None):
+        """Renders every planned segment missing from the cache."""
+        for segment in plan:
+            index, first, last, ref, path = segment
+            if path:
+                continue
+            with instrumentation.stage("encode", segment=index, frames=last - first) as span:
+                segment[4] = self.render_segment(compositor, segment, cancel=cancel)
+                span.bytes = os.path.getsize(segment[4])
+            self.rendered_segments += 1
+
+    def open_segment_writer(self, compositor, segment):
+        """(writer, scratch path) for a segment; the file only enters the store once complete."""
+        tmp_path = self.store.tmp_path(os.path.basename(segment[3]))
+        writer = FFMPEG_VideoWriter(
+            tmp_path, (compositor.width, compositor.height), self.FPS,
+            codec=self.RENDER_PROFILE["codec"], preset=self.RENDER_PROFILE["preset"],
+        )
+        return writer, tmp_path
+
+    def render_segment(self, compositor, segment, cancel=None):
+        """
+        Encode frames [first, last) as a video-only file. It is written to a scratch file and
+        only moved into the store once complete, so a crash never leaves a half-written segment.
+        """
+        writer, tmp_path = self.open_segment_writer(compositor, segment)
+        try:
             try:
-                relevant_image = self.search_image(search_term)
-                if relevant_image:
-                    searched_image = (
-                        ImageClip(relevant_image)
-                        .set_start(self.current_start)
-                        .set_duration(audio.duration)
-                        .resize(height=350)
-                        .set_position(("center", 300))
-                    )
-                    self.image_clips.append(searched_image)
-            except Exception as e:
-                print(f"Image search failed: {e}")
-
-            self.current_start += audio.duration + 0.5
-
-        # end_clip = self.create_end_title_clip("Like, Share, thanks for watching.")
-        # self.image_clips.append(end_clip)
-
-        final_audio = CompositeAudioClip(self.audio_clips)
-        final_video = CompositeVideoClip(
-            [self.video] + self.image_clips + self.subtitle_clips
-        ).set_audio(final_audio)
-
-        final_video.write_videofile(self.output_path, codec="libx264", audio_codec="aac", fps=24)
+                for frame_index in range(segment[1], segment[2]):
+                    # checked once per second of video
+                    if cancel is not None and frame_index % self.FPS == 0 and cancel.is_set():
+                        raise RenderCancelled(f"Render of {self.output_path} cancelled at frame {frame_index}")
+                    writer.write_frame(compositor.make_frame(frame_index / self.FPS))
+            finally:
+                writer.close()
+        except RenderCancelled:
+            os.remove(tmp_path)
+            raise
+        return self.store.put_file(tmp_path, name=segment[3], keep=False)
+
+    def mux(self, segments):
+        """Join the segments without re-encoding and add the dialogue track as AAC."""
+        list_path = self.store.tmp_path("concat.txt")
+        with open(list_path, "w") as f:
+            for path in segments:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        if os.path.lexists(self.output_path):
+            # the previous video may be linked into the store; never overwrite it in place
+            os.remove(self.output_path)
+        try:
+            self.ffmpeg([
+                "-f", "concat", "-safe", "0", "-i", list_path,
+                "-i", self.dialogue_wav(),
+                "-map", "0:v:0", "-map", "1:a:0",
+                "-c:v", "copy", "-c:a", "aac",
+                self.output_path,
+            ])
+        finally:
+            os.remove(list_path)
+            self.discard_wav()
+
+    def discard_wav(self):
+        if self._wav_path and os.path.exists(self._wav_path):
+            os.remove(self._wav_path)
+        self._wav_path = None
 
 
 # === Usage Example ===
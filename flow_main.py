@@ -1,12 +1,17 @@
 import os
 import logging
+import importlib
+import threading
 from db_handler import DBOperation
 from telegram_handler import TelegramBot
-from scrap_audio import VoiceGenerator
-from editor_agent import DynamicVideoEditor
 from utils import Utils
+from batch_scheduler import BatchScheduler
+from scrape_policy import RetryPolicy, CircuitBreaker, MalformedLineError, classify_failure
+import instrumentation
 import  time 
 #changes in editor  , in flow, in telegram file 
+# scraping and editing modules (moviepy, pydub, PIL, duckduckgo_search) are imported inside
+# the stage that needs them, so a stage 0 or stage 1 boot does not pay for the editor
 
 
 def run_flow():
@@ -20,9 +25,15 @@ def run_flow():
 
     bot = TelegramBot()
     db = DBOperation()
+    scheduler = BatchScheduler(db)
+    # rows are leased to this worker, so several VMs/processes can share one queue
+    worker_id = DBOperation.default_worker_id()
+    lease_s = float(os.getenv("DIALOGUE_LEASE_S", 300))
 
     logging.info("Fetching stage and unprocessed dialogues...")
-    stage_data = db.get_stage_and_unprocessed_dialogues()
+    stage_data = db.get_stage_and_unprocessed_dialogues(
+        limit=scheduler.batch_size(), worker_id=worker_id, lease_s=lease_s
+    )
     current_stage = stage_data.get("stage")
 
     if current_stage == 0:
@@ -35,45 +46,227 @@ def run_flow():
             logging.error(f"Error polling or adding dialogues: {e}")
 
     elif current_stage == 1:
-        bot.send_message("Current stage is 1, collecting the audio")
-        voice_generator = VoiceGenerator()
-        logging.info("Stage 1: Starting audio processing phase...")
-        sentences = stage_data.get("dialogues")
+        with instrumentation.timed_import("scrap_audio"):
+            from scrap_audio import VoiceGenerator
+        with instrumentation.timed_import("scrape_pipeline"):
+            from scrape_pipeline import ScrapePipeline
+        logging.info(f"Stage 1 imports: {instrumentation.get_instrumentation().import_report()}")
+
+        try:
+            sentences = stage_data.get("dialogues")
+            retry_policy = RetryPolicy()
+            breaker = CircuitBreaker(db)
+
+            # Drop lines that can never work and lines whose speaker page is currently failing
+            runnable = []
+            for cur in sentences:
+                try:
+                    speaker, _ = VoiceGenerator.split_line(cur.get("sentence"))
+                except MalformedLineError as e:
+                    logging.warning(f"Giving up on dialogue ID {cur.get('id')}: {e}")
+                    db.mark_processed(cur.get("id"), False, failure_kind=e.kind, give_up=True, worker_id=worker_id)
+                    continue
+                page = VoiceGenerator.page_url_for_speaker(speaker)
+                if breaker.allow(page):
+                    runnable.append((cur, page))
+                else:
+                    logging.info(f"Circuit open for {page}, skipping dialogue ID {cur.get('id')} this boot.")
+
+            if not runnable:
+                logging.info("Stage 1: nothing eligible this boot (backing off or circuits open).")
+                return
+
+            bot.send_message("Current stage is 1, collecting the audio")
+            voice_generator = VoiceGenerator()
+            logging.info("Stage 1: Starting audio processing phase...")
+
+            # VOICE_PACK_LINES=1: consecutive same-speaker lines are generated in one request
+            by_id = {cur.get("id"): (cur, page) for cur, page in runnable}
+            lines = [(cur.get("id"), cur.get("sentence")) for cur, _ in runnable]
+            if os.getenv("VOICE_PACK_LINES", "0") == "1":
+                groups = VoiceGenerator.pack_lines(lines)
+            else:
+                groups = [[pair] for pair in lines]
+
+            def record_results(group, started_at, busy_s, results):
+                page = by_id[group[0][0]][1]
+                # per line, so the batch scheduler sees what a line costs when lines are packed
+                line_duration = busy_s / len(group)
+                # the breaker counts requests, not lines: a failed packed request is one site failure
+                site_ok = site_failed = False
+                for dialogue_id, success_flag, failure_kind, asset in results:
+                    cur = by_id[dialogue_id][0]
+                    db.record_scrape(dialogue_id, started_at, line_duration, success_flag)
+
+                    if success_flag:
+                        marked = db.mark_processed(dialogue_id, True, asset=asset, worker_id=worker_id)
+                        site_ok = True
+                    else:
+                        failure_kind = failure_kind or "unknown"
+                        marked = db.mark_processed(
+                            dialogue_id,
+                            False,
+                            failure_kind=failure_kind,
+                            next_eligible_at=retry_policy.next_eligible_at(cur.get("audio_process_retry", 0)),
+                            give_up=retry_policy.is_permanent(failure_kind),
+                            worker_id=worker_id,
+                        )
+                        if retry_policy.counts_against_site(failure_kind):
+                            site_failed = True
+                    reported.add(dialogue_id)
+                    if marked:
+                        logging.info(f"Marked dialogue ID {dialogue_id} as processed: {success_flag} ({failure_kind})")
+                    else:
+                        logging.warning(f"Lease on dialogue ID {dialogue_id} lost before its result came in, result dropped.")
+                if site_ok:
+                    breaker.record_success(page)
+                elif site_failed:
+                    breaker.record_failure(page)
+
+            def admit(group):
+                group_ids = [dialogue_id for dialogue_id, _ in group]
+                page = by_id[group_ids[0]][1]
+
+                # keep the leases on everything not reported yet alive while this group runs
+                held = db.renew_leases(worker_id, [queued_id for queued_id in by_id if queued_id not in reported], lease_s)
+                if not set(group_ids) <= held:
+                    logging.warning(f"Lease lost on dialogue IDs {group_ids}, another worker has them now.")
+                    return ScrapePipeline.SKIP
+                if not scheduler.fits_another_line():
+                    logging.info(f"Boot budget used up, leaving dialogue IDs {group_ids} for the next boot.")
+                    return ScrapePipeline.STOP
+                if not breaker.allow(page):
+                    logging.info(f"Circuit opened for {page}, leaving dialogue IDs {group_ids} for later.")
+                    return ScrapePipeline.SKIP
+                logging.info(f"Processing dialogue IDs {group_ids}: {[line for _, line in group]}")
+                return ScrapePipeline.RUN
 
-        for cur in sentences:
-            dialogue_id = cur.get("id")
-            dialogue_line = cur.get("sentence")
+            reported = set()
+            # admit() renews between groups; this keeps groups still in flight after the last
+            # admit (or one slow group) from losing their lease to another worker
+            stop_renewing = threading.Event()
 
+            def keep_leases():
+                while not stop_renewing.wait(lease_s / 3):
+                    db.renew_leases(worker_id, [queued_id for queued_id in by_id if queued_id not in reported], lease_s)
+
+            renewer = threading.Thread(target=keep_leases, daemon=True)
+            renewer.start()
             try:
-                logging.info(f"Processing dialogue ID {dialogue_id}: {dialogue_line}")
-                success_flag = voice_generator.process_conversation(dialogue_line, dialogue_id)
-                db.mark_processed(dialogue_id, success_flag)
-                logging.info(f"Marked dialogue ID {dialogue_id} as processed: {success_flag}")
-            except Exception as e:
-                logging.error(f"Error processing dialogue ID {dialogue_id}: {e}")
-                db.mark_processed(dialogue_id, False)
+                if os.getenv("VOICE_PIPELINE", "0") == "1":
+                    # browser, downloads and extract/trim overlap; lines are recorded as they finish
+                    ScrapePipeline(voice_generator).run(groups, admit, record_results)
+                else:
+                    for group in groups:
+                        decision = admit(group)
+                        if decision == ScrapePipeline.STOP:
+                            break
+                        if decision == ScrapePipeline.SKIP:
+                            continue
+
+                        started_at = time.time()
+                        try:
+                            results = voice_generator.process_group(group)
+                        except Exception as e:
+                            logging.error(f"Error processing dialogue IDs {[i for i, _ in group]}: {e}")
+                            results = [(dialogue_id, False, classify_failure(e), None) for dialogue_id, _ in group]
+                        record_results(group, started_at, time.time() - started_at, results)
+            finally:
+                stop_renewing.set()
+                renewer.join()
 
-        bot.send_message("Collection of audio ended, shutting down the VM")
+            voice_generator.close()
+            bot.send_message("Collection of audio ended, shutting down the VM")
+        finally:
+            # hand back whatever this boot did not get to
+            db.release_leases(worker_id)
 
     elif current_stage == 2:
+        # the editor's heavy dependencies first, each on its own and in dependency order, so
+        # the editor_agent entry is only what the editor adds on top of them
+        for module in ("numpy", "PIL.Image", "pydub", "moviepy.video.io.VideoFileClip", "duckduckgo_search"):
+            with instrumentation.timed_import(module):
+                importlib.import_module(module)
+        with instrumentation.timed_import("editor_agent"):
+            from editor_agent import DynamicVideoEditor, RenderCancelled
+        # already loaded by editor_agent
+        from edit_plan import PlanError
+        from artifact_store import ArtifactStore
+        logging.info(f"Stage 2 imports: {instrumentation.get_instrumentation().import_report()}")
+
         logging.info("Stage 2: Starting video editing...")
         bot.send_message("Ready to edit the video")
         assets = db.get_raedy_assests()
         editor = DynamicVideoEditor(
-            video_path=r"/home/ubuntu/mainrepo/stewie_v1/video_assests/video_without_audio.webm", 
+            video_path=os.getenv("BACKGROUND_VIDEO_PATH", r"/home/ubuntu/mainrepo/stewie_v1/video_assests/video_without_audio.webm"),
             output_path="output_final_video.mp4",
             dialogue_data=assets,
           
         )
-        editor.edit()
-        logging.info("Video editing completed.")
+        # a low-res preview goes out first; replying "cancel" stops the final render
+        cancel = threading.Event()
+        render_done = threading.Event()
+        delivery = []
+
+        def deliver_preview(path, since):
+            try:
+                with instrumentation.stage("upload", step="preview") as span:
+                    span.bytes = os.path.getsize(path)
+                    bot.send_video_file(path, caption="Preview, the final video is rendering. Reply \"cancel\" to stop it.")
+                while not render_done.is_set():
+                    if bot.cancel_requested(since):
+                        logging.info("Cancel received, stopping the final render.")
+                        cancel.set()
+                        return
+                    render_done.wait(float(os.getenv("PREVIEW_CANCEL_POLL_S", 5)))
+            except Exception as e:
+                logging.error(f"Error while sending the preview: {e}")
+
+        def on_preview(path):
+            thread = threading.Thread(target=deliver_preview, args=(path, time.time()), daemon=True)
+            thread.start()
+            delivery.append((thread, path))
+
+        cancelled = rejected = False
+        try:
+            editor.edit(on_preview=on_preview if os.getenv("VIDEO_PREVIEW", "1") == "1" else None, cancel=cancel)
+            logging.info("Video editing completed.")
+        except RenderCancelled as e:
+            logging.info(str(e))
+            cancelled = True
+        except PlanError as e:
+            # nothing was rendered; the script is dropped below so the next boot polls for a new one
+            logging.error(f"Edit plan rejected: {e}")
+            rejected = True
+            bot.send_message(
+                "Video not rendered, the script has problems:\n" + "\n".join(e.problems)
+                + "\nThe script was dropped, please send a corrected one."
+            )
+        finally:
+            render_done.set()
+            for thread, path in delivery:
+                thread.join(timeout=60)
+                if os.path.exists(path):
+                    os.remove(path)
         db.truncate_dialouge_stage()
-        Utils.archive_audio_assets()
+        store = ArtifactStore()
+        Utils.archive_audio_assets(store)
+        if cancelled or rejected:
+            if cancelled:
+                bot.send_message("Final render cancelled, the video was not finished.")
+            store.gc()
+            return
         try:
             bot.send_message("editimg completed sending you video")
-            bot.send_video_file("")
+            with instrumentation.stage("upload") as span:
+                span.bytes = os.path.getsize(editor.output_path)
+                bot.send_video_file(editor.output_path)
         except Exception as e:
             logging.error(f"Error  while sending the video: {e}")
+        # keep the finished video around until the store needs the space
+        store.put_file(editor.output_path, name=f"archive/videos/{time.strftime('%Y-%m-%d_%H-%M-%S')}.mp4")
+        freed = store.gc()
+        logging.info(f"Artifact GC freed {freed} bytes")
 
     else:
         logging.warning(f"Unexpected stage value: {current_stage}")
@@ -84,7 +277,10 @@ if __name__ == "__main__":
     except Exception as e:
         logging.critical(f"Critical failure in main workflow: {e}")
     finally:
-        time.sleep(60*3)
+        instrumentation.get_instrumentation().export_prometheus()
+        grace_period = BatchScheduler(DBOperation()).grace_period()
+        logging.info(f"Waiting {grace_period:.0f}s before shutting down the VM")
+        time.sleep(grace_period)
         print("shutting down the vm")
         #pass
         #here  shutdwon the  machine  
@@ -2,6 +2,8 @@ import os
 import logging
 import requests
 from duckduckgo_search import DDGS
+import instrumentation
+from artifact_store import ArtifactStore
 
 class ImageDownloader:
     def __init__(self, max_images=10, download_folder="image_assests"):
@@ -10,6 +12,7 @@ class ImageDownloader:
 
         # Create required folders
         os.makedirs(self.download_folder, exist_ok=True)
+        self.store = ArtifactStore()
         self._setup_logging()
 
     def _setup_logging(self):
@@ -31,37 +34,41 @@ class ImageDownloader:
         self.logger.info(f"Starting search for: {term}")
         downloaded_image_paths = []
 
-        try:
-            with DDGS() as ddgs:
-                search_results = ddgs.images(keywords=term)
-                image_data = list(search_results)
-                image_urls = [item.get("image") for item in image_data[:self.max_images]]
-
-            for idx, url in enumerate(image_urls):
-                if not url:
-                    self.logger.warning(f"Empty URL at index {idx}")
-                    continue
-
-                try:
-                    self.logger.info(f"Downloading image {idx + 1}: {url}")
-                    response = requests.get(url, timeout=10)
-                    response.raise_for_status()
-
-                    img_name = f"{term.replace(' ', '_')}_{idx + 1}.jpg"
-                    img_path = os.path.join(self.download_folder, img_name)
-
-                    with open(img_path, 'wb') as img_file:
-                        img_file.write(response.content)
-
-                    downloaded_image_paths.append(img_path)
-
-                except requests.RequestException as e:
-                    self.logger.error(f"Request error for image {idx + 1}: {e}")
-                except Exception as e:
-                    self.logger.error(f"Failed to download image {idx + 1}: {e}")
-
-        except Exception as e:
-            self.logger.critical(f"Image search failed: {e}")
+        with instrumentation.stage("image_search", term=term) as span:
+            try:
+                with DDGS() as ddgs:
+                    search_results = ddgs.images(keywords=term)
+                    image_data = list(search_results)
+                    image_urls = [item.get("image") for item in image_data[:self.max_images]]
+
+                for idx, url in enumerate(image_urls):
+                    if not url:
+                        self.logger.warning(f"Empty URL at index {idx}")
+                        continue
+
+                    try:
+                        self.logger.info(f"Downloading image {idx + 1}: {url}")
+                        response = requests.get(url, timeout=10)
+                        response.raise_for_status()
+
+                        img_name = f"{term.replace(' ', '_')}_{idx + 1}.jpg"
+                        img_path = os.path.join(self.download_folder, img_name)
+
+                        # identical images from different searches are stored once
+                        ref = f"images/{img_name}"
+                        self.store.put_bytes(response.content, ".jpg", name=ref)
+                        self.store.checkout(ref, img_path)
+
+                        downloaded_image_paths.append(img_path)
+
+                    except requests.RequestException as e:
+                        self.logger.error(f"Request error for image {idx + 1}: {e}")
+                    except Exception as e:
+                        self.logger.error(f"Failed to download image {idx + 1}: {e}")
+
+            except Exception as e:
+                self.logger.critical(f"Image search failed: {e}")
+            span.bytes = sum(os.path.getsize(p) for p in downloaded_image_paths)
 
         self.logger.info(f"Downloaded {len(downloaded_image_paths)} images successfully.")
         return downloaded_image_paths
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import resource
+import threading
+import cProfile
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+from db_handler import DBOperation
+
+
+class Span:
+    """A single timed stage. The body of a `stage()` block can set `bytes` and `labels`."""
+
+    def __init__(self, stage, run_id, labels=None):
+        self.stage = stage
+        self.run_id = run_id
+        self.labels = dict(labels or {})
+        self.bytes = 0
+        self.started_at = time.time()
+        self.duration_s = None
+        self.peak_rss_bytes = None
+        self.status = "ok"
+
+
+class Instrumentation:
+    """
+    Records per-stage spans (duration, bytes, peak RSS) into the `stage_metrics` table
+    and exports them as a Prometheus textfile.
+
+    Profiling is switched on with the STEWIE_PROFILE env var, e.g.
+        STEWIE_PROFILE=encode,download   or   STEWIE_PROFILE=all
+    The profile of every matching stage is dumped under runtime_logs/profiles/<run_id>/.
+
+    Peak RSS is the highest VmRSS seen while the span was open, sampled every
+    STEWIE_RSS_SAMPLE_MS (default 20) by one background thread.
+    """
+
+    def __init__(self, db_name="stewie_database.db", run_id=None, profile_dir="runtime_logs/profiles"):
+        self.db_name = db_name
+        self.run_id = run_id or os.getenv("STEWIE_RUN_ID") or f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{os.getpid()}"
+        self.profile_dir = os.path.join(profile_dir, self.run_id)
+        self.profile_stages = self._parse_profile_env(os.getenv("STEWIE_PROFILE", ""))
+        self.profile_tools = self._parse_profile_env(os.getenv("STEWIE_PROFILE_TOOLS", "cprofile,tracemalloc"))
+        self.enabled = os.getenv("STEWIE_METRICS", "1") != "0"
+        self.logger = logging.getLogger("Instrumentation")
+        self._table_ready = False
+        self._profiling = False
+        self._profile_counter = {}
+        # (module, seconds, modules loaded) per timed_import block
+        self.imports = []
+        # spans still running, sampled for their peak RSS every STEWIE_RSS_SAMPLE_MS
+        self.rss_sample_s = float(os.getenv("STEWIE_RSS_SAMPLE_MS", 20)) / 1000
+        self._open_spans = set()
+        self._spans_lock = threading.Lock()
+        self._sampler = None
+
+    @staticmethod
+    def _parse_profile_env(value):
+        return {part.strip().lower() for part in value.split(",") if part.strip()}
+
+    def connect(self):
+        # same busy timeout as DBOperation: spans are written from several threads and workers
+        return sqlite3.connect(self.db_name, timeout=DBOperation.BUSY_TIMEOUT_S)
+
+    def create_stage_metrics_table(self):
+        query = """
+        CREATE TABLE IF NOT EXISTS stage_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            started_at REAL,
+            duration_s REAL,
+            bytes INTEGER DEFAULT 0,
+            peak_rss_bytes INTEGER,
+            status TEXT,
+            labels TEXT
+        );
+        """
+        conn = None
+        try:
+            conn = self.connect()
+            conn.execute(query)
+            conn.commit()
+            self._table_ready = True
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite error during stage_metrics creation: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    # ---- memory -------------------------------------------------------
+
+    @staticmethod
+    def _read_rss():
+        """Current RSS in bytes from VmRSS, or None where /proc is not available."""
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    @staticmethod
+    def _read_process_peak_rss():
+        """The process-wide ru_maxrss in bytes (never reset, so it is a peak since process start)."""
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+    def _sample_rss(self):
+        """
+        Sampler thread: while spans are open, folds the current RSS into each open span's peak.
+        The kernel high-water mark is left alone, so nested and concurrent spans (and ru_maxrss
+        seen by a parent process) are not disturbed.
+        """
+        while True:
+            time.sleep(self.rss_sample_s)
+            rss = self._read_rss()
+            if rss is None:
+                return
+            with self._spans_lock:
+                for span in self._open_spans:
+                    span.peak_rss_bytes = max(span.peak_rss_bytes or 0, rss)
+
+    def _open_span(self, span):
+        rss = self._read_rss()
+        span.peak_rss_bytes = rss
+        with self._spans_lock:
+            self._open_spans.add(span)
+            if self._sampler is None and rss is not None:
+                self._sampler = threading.Thread(target=self._sample_rss, name="rss-sampler", daemon=True)
+                self._sampler.start()
+
+    def _close_span(self, span):
+        with self._spans_lock:
+            self._open_spans.discard(span)
+        rss = self._read_rss()
+        if rss is None:
+            span.peak_rss_bytes = self._read_process_peak_rss()
+        else:
+            span.peak_rss_bytes = max(span.peak_rss_bytes or 0, rss)
+
+    # ---- spans --------------------------------------------------------
+
+    def _should_profile(self, stage):
+        return bool(self.profile_stages) and ("all" in self.profile_stages or stage.lower() in self.profile_stages)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """
+        Time a pipeline stage:
+
+            with instrumentation.stage("download", dialogue_id=3) as span:
+                ...
+                span.bytes = os.path.getsize(path)
+        """
+        span = Span(name, self.run_id, labels)
+        profiler = None
+        started_tracemalloc = False
+
+        if self._should_profile(name) and not self._profiling:
+            self._profiling = True
+            if "tracemalloc" in self.profile_tools and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracemalloc = True
+            if "cprofile" in self.profile_tools:
+                profiler = cProfile.Profile()
+                profiler.enable()
+
+        self._open_span(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            span.duration_s = time.perf_counter() - start
+            self._close_span(span)
+            if profiler is not None or started_tracemalloc:
+                self._dump_profile(span, profiler, started_tracemalloc)
+                self._profiling = False
+            self.record(span)
+
+    @contextmanager
+    def timed_import(self, name):
+        """
+        Time an import as an "import" span, labelled with how many modules it pulled in:
+
+            with instrumentation.timed_import("editor_agent"):
+                from editor_agent import DynamicVideoEditor
+        """
+        before = len(sys.modules)
+        with self.stage("import", module=name) as span:
+            yield span
+            span.labels["new_modules"] = len(sys.modules) - before
+        self.imports.append((name, span.duration_s, span.labels["new_modules"]))
+
+    def import_report(self):
+        """One line per-module import cost for this process, slowest first."""
+        if not self.imports:
+            return "no timed imports"
+        ranked = sorted(self.imports, key=lambda item: item[1], reverse=True)
+        total = sum(seconds for _, seconds, _ in ranked)
+        return f"{total:.3f}s total: " + ", ".join(
+            f"{name} {seconds:.3f}s ({count} modules)" for name, seconds, count in ranked
+        )
+
+    def _dump_profile(self, span, profiler, started_tracemalloc):
+        count = self._profile_counter.get(span.stage, 0) + 1
+        self._profile_counter[span.stage] = count
+        base = os.path.join(self.profile_dir, f"{span.stage}_{count}")
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(f"{base}.prof")
+            if started_tracemalloc:
+                snapshot = tracemalloc.take_snapshot()
+                _, traced_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                with open(f"{base}.tracemalloc.txt", "w") as f:
+                    f.write(f"traced peak: {traced_peak} bytes\n")
+                    for stat in snapshot.statistics("lineno")[:50]:
+                        f.write(f"{stat}\n")
+            self.logger.info(f"Profile for stage '{span.stage}' written to {base}.*")
+        except Exception as e:
+            self.logger.error(f"Failed to dump profile for stage '{span.stage}': {e}")
+
+    def record(self, span):
+        self.logger.info(
+            f"[{span.run_id}] stage={span.stage} status={span.status} duration={span.duration_s:.3f}s "
+            f"bytes={span.bytes} peak_rss={span.peak_rss_bytes} labels={span.labels}"
+        )
+        if not self.enabled:
+            return
+        if not self._table_ready:
+            self.create_stage_metrics_table()
+        conn = None
+        try:
+            conn = self.connect()
+            conn.execute("""
+                INSERT INTO stage_metrics (run_id, stage, started_at, duration_s, bytes, peak_rss_bytes, status, labels)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+            """, (span.run_id, span.stage, span.started_at, span.duration_s, int(span.bytes or 0),
+                  span.peak_rss_bytes, span.status, json.dumps(span.labels, default=str)))
+            conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite error while recording span '{span.stage}': {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    # ---- export -------------------------------------------------------
+
+    def get_run_summary(self, run_id=None):
+        """Per-stage totals for one run (the current run by default)."""
+        if not self._table_ready:
+            self.create_stage_metrics_table()
+        conn = None
+        try:
+            conn = self.connect()
+            rows = conn.execute("""
+                SELECT stage, COUNT(*), SUM(duration_s), SUM(bytes), MAX(peak_rss_bytes)
+                FROM stage_metrics WHERE run_id = ? GROUP BY stage ORDER BY stage;
+            """, (run_id or self.run_id,)).fetchall()
+            return {
+                row[0]: {"count": row[1], "duration_s": row[2], "bytes": row[3], "peak_rss_bytes": row[4]}
+                for row in rows
+            }
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite error while summarising run: {e}")
+            return {}
+        finally:
+            if conn:
+                conn.close()
+
+    def export_prometheus(self, path="runtime_logs/stewie_metrics.prom"):
+        """Write all recorded spans as a Prometheus textfile (node_exporter textfile collector format)."""
+        if not self._table_ready:
+            self.create_stage_metrics_table()
+        conn = None
+        try:
+            conn = self.connect()
+            totals = conn.execute("""
+                SELECT stage, status, COUNT(*), SUM(duration_s), SUM(bytes), MAX(peak_rss_bytes)
+                FROM stage_metrics GROUP BY stage, status ORDER BY stage, status;
+            """).fetchall()
+            last = conn.execute("""
+                SELECT m.stage, m.duration_s FROM stage_metrics m
+                JOIN (SELECT stage, MAX(id) AS id FROM stage_metrics GROUP BY stage) l ON l.id = m.id
+                ORDER BY m.stage;
+            """).fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite error during metrics export: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+        lines = [
+            "# HELP stewie_stage_runs_total Number of times a pipeline stage ran.",
+            "# TYPE stewie_stage_runs_total counter",
+        ]
+        lines += [f'stewie_stage_runs_total{{stage="{s}",status="{st}"}} {c}' for s, st, c, _, _, _ in totals]
+        lines += [
+            "# HELP stewie_stage_duration_seconds_total Wall time spent in a pipeline stage.",
+            "# TYPE stewie_stage_duration_seconds_total counter",
+        ]
+        lines += [f'stewie_stage_duration_seconds_total{{stage="{s}",status="{st}"}} {d or 0:.6f}' for s, st, _, d, _, _ in totals]
+        lines += [
+            "# HELP stewie_stage_bytes_total Bytes produced or transferred by a pipeline stage.",
+            "# TYPE stewie_stage_bytes_total counter",
+        ]
+        lines += [f'stewie_stage_bytes_total{{stage="{s}",status="{st}"}} {b or 0}' for s, st, _, _, b, _ in totals]
+        lines += [
+            "# HELP stewie_stage_peak_rss_bytes Highest peak RSS observed during a pipeline stage.",
+            "# TYPE stewie_stage_peak_rss_bytes gauge",
+        ]
+        lines += [f'stewie_stage_peak_rss_bytes{{stage="{s}",status="{st}"}} {r or 0}' for s, st, _, _, _, r in totals]
+        lines += [
+            "# HELP stewie_stage_last_duration_seconds Duration of the most recent run of a stage.",
+            "# TYPE stewie_stage_last_duration_seconds gauge",
+        ]
+        lines += [f'stewie_stage_last_duration_seconds{{stage="{s}"}} {d or 0:.6f}' for s, d in last]
+
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, path)
+            self.logger.info(f"Prometheus metrics written to {path}")
+            return path
+        except OSError as e:
+            self.logger.error(f"Failed to write Prometheus textfile: {e}")
+            return None
+
+
+_default = None
+
+
+def get_instrumentation():
+    """Shared Instrumentation instance for the current process."""
+    global _default
+    if _default is None:
+        _default = Instrumentation()
+    return _default
+
+
+def stage(name, **labels):
+    """Shortcut for `get_instrumentation().stage(...)`."""
+    return get_instrumentation().stage(name, **labels)
+
+
+def timed_import(name):
+    """Shortcut for `get_instrumentation().timed_import(...)`."""
+    return get_instrumentation().timed_import(name)
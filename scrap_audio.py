@@ -2,24 +2,57 @@ import time
 import requests
 import os
 import logging
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from moviepy.editor import VideoFileClip
 from pydub import AudioSegment
-from pydub.silence import split_on_silence
+from pydub.silence import split_on_silence, detect_silence, detect_nonsilent
+import instrumentation
+from artifact_store import ArtifactStore
+from voice_backends import HttpVoiceBackend, create_backend
+from scrape_policy import (
+    DownloadError,
+    ExtractError,
+    MalformedLineError,
+    PauseSplitError,
+    ScrapeError,
+    classify_failure,
+)
 
 class VoiceGenerator:
-    PETER_URL = "https://www.tryparrotai.com/ai-voice/peter-griffin"
-    STEWIE_URL = "https://www.tryparrotai.com/ai-voice/stewie-griffin"
+    # PARROT_BASE_URL lets the benchmark point the scraper at a local stand-in
+    PARROT_BASE_URL = os.getenv("PARROT_BASE_URL", "https://www.tryparrotai.com").rstrip("/")
+    PETER_URL = f"{PARROT_BASE_URL}/ai-voice/peter-griffin"
+    STEWIE_URL = f"{PARROT_BASE_URL}/ai-voice/stewie-griffin"
+    MAX_SENTENCE_CHARS = 100
+    # put between packed lines so the voice leaves a gap we can cut at
+    PAUSE_MARKER = " ... "
+    # pauses longer than MIN_SILENCE_MS are cut down to KEEP_SILENCE_MS (trim_silence)
+    SILENCE_THRESH_DB = -40
+    MIN_SILENCE_MS = 500
+    KEEP_SILENCE_MS = 250
 
-    def __init__(self):
+    def __init__(self, backend=None):
         self.setup_logging()
-        self.driver = self.setup_driver()
+        # one pooled session for the generate requests and the media downloads
+        self.session = HttpVoiceBackend.create_session()
+        # headless Chrome by default; VOICE_BACKENDS=http,selenium tries the HTTP request first (see voice_backends)
+        self.backend = backend or create_backend(self.PARROT_BASE_URL, session=self.session)
         self.output_dir = "audio_assests"
         os.makedirs(self.output_dir, exist_ok=True)
+        # finished clips are kept in the store; audio_assests/ holds hard links to them
+        self.store = ArtifactStore()
+
+    @classmethod
+    def page_url_for_speaker(cls, speaker):
+        return cls.PETER_URL if speaker.lower() == "peter" else cls.STEWIE_URL
+
+    @staticmethod
+    def split_line(line):
+        """'Peter: some text' -> ('Peter', 'some text'); raises MalformedLineError otherwise."""
+        if ":" not in line:
+            raise MalformedLineError(f"Skipping malformed line: '{line}'")
+        speaker, sentence = map(str.strip, line.split(":", 1))
+        if len(sentence) > VoiceGenerator.MAX_SENTENCE_CHARS:
+            raise MalformedLineError(f"Skipping sentence (too long): '{sentence}'")
+        return speaker, sentence
 
     def setup_logging(self):
         """Set up logging configuration"""
@@ -36,157 +69,209 @@ class VoiceGenerator:
         self.logger.addHandler(handler)
         self.logger.info("Logging initialized.")
 
-    def setup_driver(self):
-        """Setup the WebDriver for Selenium"""
-        try:
-            options = Options()
-            options.add_argument("--headless")
-            options.add_argument("--window-size=1920,1080")
-            driver = webdriver.Chrome(options=options)
-            self.logger.info("WebDriver initialized successfully.")
-            return driver
-        except Exception as e:
-            self.logger.error(f"Error initializing WebDriver: {e}")
-            raise
+    def close(self):
+        """Release the backend (quits Chrome if it was started) and the HTTP session"""
+        self.backend.close()
+        self.session.close()
 
     def download_video(self, url, filename):
         """Download video from the provided URL"""
         try:
             self.logger.info(f"Downloading from: {url}")
-            r = requests.get(url, stream=True)
-            if r.status_code == 200:
-                with open(filename, "wb") as f:
-                    for chunk in r.iter_content(1024 * 1024):
-                        f.write(chunk)
-                self.logger.info("Video downloaded successfully!")
-            else:
-                self.logger.error(f"Failed to download video. Status: {r.status_code}")
+            with instrumentation.stage("download") as span:
+                r = self.session.get(url, stream=True)
+                if r.status_code == 200:
+                    with open(filename, "wb") as f:
+                        for chunk in r.iter_content(1024 * 1024):
+                            f.write(chunk)
+                            span.bytes += len(chunk)
+                    self.logger.info("Video downloaded successfully!")
+                else:
+                    span.status = "error"
+                    self.logger.error(f"Failed to download video. Status: {r.status_code}")
+                    raise DownloadError(f"Download failed with HTTP {r.status_code}: {url}")
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error downloading video: {e}")
-            raise
-
-    def convert_video_to_audio(self, video_filename, audio_filename):
-        """Convert video file to audio, save in 'audio_assests', and delete the original video."""
-        try:
-            audio_path = os.path.join(self.output_dir, audio_filename)
-            self.logger.info(f"Converting {video_filename} to {audio_path}")
+            raise DownloadError(str(e)) from e
 
-            video_clip = VideoFileClip(video_filename)
-            audio_clip = video_clip.audio
-            audio_clip.write_audiofile(audio_path,logger=None)
+    @classmethod
+    def trim_silence(cls, audio):
+        """Shortens every pause longer than MIN_SILENCE_MS to KEEP_SILENCE_MS on each side."""
+        # Split the audio based on silence
+        chunks = split_on_silence(
+            audio,
+            min_silence_len=cls.MIN_SILENCE_MS,  # Silence length to consider for splitting
+            silence_thresh=cls.SILENCE_THRESH_DB,  # Silence threshold in dB
+            keep_silence=cls.KEEP_SILENCE_MS  # Keep 250ms of silence between chunks
+        )
 
-            audio_clip.close()
-            video_clip.close()
+        # Combine the chunks after splitting
+        combined_audio = AudioSegment.empty()
+        for chunk in chunks:
+            combined_audio += chunk
+        return combined_audio
 
-            # Delete original video file
-            if os.path.exists(video_filename):
-                os.remove(video_filename)
-                self.logger.info(f"Deleted video file: {video_filename}")
-            else:
-                self.logger.warning(f"Video file not found: {video_filename}")
-
-            self.logger.info(f"Audio saved as {audio_path}")
-            return audio_path
-        except Exception as e:
-            self.logger.error(f"Error converting video to audio: {e}")
-            raise
-
-    def remove_silence(self, audio_file):
-        """Remove silence from audio"""
-        try:
-            audio = AudioSegment.from_mp3(audio_file)
-
-            # Split the audio based on silence
-            chunks = split_on_silence(
-                audio,
-                min_silence_len=500,  # Silence length to consider for splitting
-                silence_thresh=-40,   # Silence threshold in dB
-                keep_silence=250      # Keep 250ms of silence between chunks
+    @classmethod
+    def split_on_pauses(cls, audio, count):
+        """
+        Cuts a packed clip into `count` clips at its `count - 1` longest pauses.
+        Raises PauseSplitError when there are not enough pauses or a piece has no speech.
+        """
+        silences = [
+            (start, end) for start, end in detect_silence(
+                audio, min_silence_len=cls.MIN_SILENCE_MS, silence_thresh=cls.SILENCE_THRESH_DB
             )
+            if start > 0 and end < len(audio)
+        ]
+        if len(silences) < count - 1:
+            raise PauseSplitError(f"Expected {count - 1} pauses in the packed clip, found {len(silences)}")
+        pauses = sorted(sorted(silences, key=lambda s: s[1] - s[0], reverse=True)[:count - 1])
+        cuts = [0] + [(start + end) // 2 for start, end in pauses] + [len(audio)]
+        pieces = [audio[a:b] for a, b in zip(cuts, cuts[1:])]
+        for piece in pieces:
+            if not detect_nonsilent(piece, min_silence_len=cls.MIN_SILENCE_MS, silence_thresh=cls.SILENCE_THRESH_DB):
+                raise PauseSplitError("A piece of the packed clip has no speech in it")
+        return pieces
 
-            # Combine the chunks after splitting
-            combined_audio = AudioSegment.empty()
-            for chunk in chunks:
-                combined_audio += chunk
-
-            # Export the combined audio to the same output file (overwrite original)
-            combined_audio.export(audio_file, format="mp3")
-            self.logger.info(f"Processed audio saved to {audio_file}")
-            return audio_file
+    def store_clip(self, audio_path, duration_ms, sample_rate):
+        """Moves a finished clip into the artifact store; returns its manifest entry."""
+        try:
+            size = os.path.getsize(audio_path)
+            blob = self.store.put_file(audio_path, name=f"audio/{os.path.basename(audio_path)}")
         except Exception as e:
-            self.logger.error(f"Error removing silence from audio: {e}")
-            raise
+            raise ExtractError(f"Could not store {audio_path}: {e}") from e
+        # what the editor needs to lay out the timeline without opening the file
+        return {
+            "path": blob,
+            "duration_ms": duration_ms,
+            "sample_rate": sample_rate,
+            "bytes": size,
+        }
 
-    def generate_audio_from_sentence(self, sentence, speaker, index):
-        """Generate audio from sentence using the specified speaker"""
-        try:
-            page_url = self.PETER_URL if speaker.lower() == "peter" else self.STEWIE_URL
-            filename_prefix = speaker.lower()
+    @classmethod
+    def pack_lines(cls, lines):
+        """
+        Groups consecutive lines of the same speaker whose sentences, joined with PAUSE_MARKER,
+        still fit in MAX_SENTENCE_CHARS. `lines` is [(dialogue_id, "Speaker: text"), ...];
+        returns a list of such lists. Lines that do not parse are left on their own.
+        """
+        groups, current_speaker, current_chars = [], None, 0
+        for dialogue_id, line in lines:
+            try:
+                speaker, sentence = cls.split_line(line)
+            except MalformedLineError:
+                groups.append([(dialogue_id, line)])
+                current_speaker = None
+                continue
+            packed_chars = current_chars + len(cls.PAUSE_MARKER) + len(sentence)
+            if speaker.lower() == current_speaker and packed_chars <= cls.MAX_SENTENCE_CHARS:
+                groups[-1].append((dialogue_id, line))
+                current_chars = packed_chars
+            else:
+                groups.append([(dialogue_id, line)])
+                current_speaker, current_chars = speaker.lower(), len(sentence)
+        return groups
 
-            # Load the page
-            self.driver.delete_all_cookies()
-            self.logger.info("Cookies cleared.")
-            self.driver.get(page_url)
+    def request_group(self, group):
+        """
+        Sends one group from pack_lines (its sentences joined with PAUSE_MARKER) and returns the
+        job for the rest of the line: {"ids", "url", "mp4_path", "audio_paths"}.
+        """
+        ids = [dialogue_id for dialogue_id, _ in group]
+        speaker = self.split_line(group[0][1])[0]
+        text = self.PAUSE_MARKER.join(self.split_line(line)[1] for _, line in group)
+        prefix = speaker.lower()
+        tag = str(ids[0]) if len(ids) == 1 else f"{ids[0]}-{ids[-1]}"
+        self.logger.info(f"Generating for IDs {ids}: '{text}'")
 
-            # Input text
-            textarea = WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located((By.TAG_NAME, "textarea"))
-            )
-            textarea.clear()
-            textarea.send_keys(sentence)
+        # raises a ScrapeError when no media URL comes back
+        url = self.backend.generate(self.page_url_for_speaker(speaker), text, tag)
+        return {
+            "ids": ids,
+            "url": url,
+            "mp4_path": f"{prefix}_voice_{tag}.mp4",
+            "audio_paths": [os.path.join(self.output_dir, f"{prefix}_audio_{dialogue_id}.mp3") for dialogue_id in ids],
+        }
 
-            # Click generate
-            generate_btn = self.driver.find_element(By.XPATH, '//button[contains(text(), "Generate")]')
-            generate_btn.click()
+    def process_group(self, group):
+        """
+        Generates a group from pack_lines (a single line is a group of one) with one request and
+        splits the result back into one clip per line; the same request_group / extract_clips
+        steps ScrapePipeline runs. Returns [(dialogue_id, success, failure_kind, asset), ...].
+        If a packed clip cannot be split at its pauses, the lines are generated one by one.
+        """
+        ids = [dialogue_id for dialogue_id, _ in group]
+        job = None
+        try:
+            job = self.request_group(group)
+            self.download_video(job["url"], job["mp4_path"])
+            clips = extract_clips(job["mp4_path"], job["audio_paths"])
+            results = [
+                (dialogue_id, True, None, self.store_clip(audio_path, duration_ms, sample_rate))
+                for dialogue_id, audio_path, (duration_ms, sample_rate) in zip(ids, job["audio_paths"], clips)
+            ]
+            time.sleep(2)
+            return results
 
-            # Wait for video
-            video = WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located((By.TAG_NAME, "video"))
-            )
+        except PauseSplitError as e:
+            self.logger.warning(f"{e}; generating IDs {ids} one by one")
+            return [result for pair in group for result in self.process_group([pair])]
+        except MalformedLineError as e:
+            self.logger.warning(str(e))
+            return [(dialogue_id, False, e.kind, None) for dialogue_id in ids]
+        except Exception as e:
+            self.logger.error(f"Error processing IDs {ids}: {e}")
+            kind = classify_failure(e)
+            return [(dialogue_id, False, kind, None) for dialogue_id in ids]
+        finally:
+            if job and os.path.exists(job["mp4_path"]):
+                os.remove(job["mp4_path"])
 
-            for _ in range(30):
-                video_url = video.get_attribute("src")
-                if video_url and video_url.startswith("https://"):
-                    break
-                time.sleep(1)
-
-            if video_url:
-                self.logger.info(f"Video URL: {video_url}")
-                mp4_name = f"{filename_prefix}_voice_{index}.mp4"
-                mp3_name = f"{filename_prefix}_audio_{index}.mp3"
-                self.download_video(video_url, mp4_name)
-                audio_path = self.convert_video_to_audio(mp4_name, mp3_name)
-                
-                # Remove silence from the audio
-                self.remove_silence(audio_path)
+def extract_clips(mp4_path, audio_paths):
+    """
+    Turns a downloaded clip into one trimmed MP3 per entry of `audio_paths`, cutting at the
+    pauses when there is more than one. Deletes the MP4. Returns [(duration_ms, sample_rate)].
+    Module level so ScrapePipeline can run it in a worker process.
+    Local failures (ffmpeg, pydub, disk) are raised as ExtractError, so they do not count
+    against the voice site.
+    """
+    try:
+        return _extract_clips(mp4_path, audio_paths)
+    except ScrapeError:
+        raise
+    except Exception as e:
+        raise ExtractError(f"Could not extract {mp4_path}: {e}") from e
 
-            else:
-                self.logger.warning("Video URL not found.")
-        except Exception as e:
-            self.logger.error(f"Error during sentence generation: {e}")
-            raise
 
-    def process_conversation(self, line: str, dialogue_id: int) -> bool:
-        """Process a single conversation line to generate an audio file"""
-        try:
-            if ":" not in line:
-                self.logger.warning(f"Skipping malformed line: '{line}'")
-                return False
+def _extract_clips(mp4_path, audio_paths):
+    from moviepy.video.io.VideoFileClip import VideoFileClip
 
-            speaker, sentence = map(str.strip, line.split(":", 1))
+    packed_path = os.path.splitext(mp4_path)[0] + ".mp3"
+    with instrumentation.stage("extract") as span:
+        video_clip = VideoFileClip(mp4_path)
+        video_clip.audio.write_audiofile(packed_path, logger=None)
+        video_clip.close()
+        span.bytes = os.path.getsize(packed_path)
+    os.remove(mp4_path)
 
-            if len(sentence) <= 100:
-                self.logger.info(f"Generating for: '{sentence}' with ID: {dialogue_id}")
-                self.generate_audio_from_sentence(sentence, speaker, dialogue_id)
-                time.sleep(2)
-                return True  # Success
-            else:
-                self.logger.warning(f"Skipping sentence (too long): '{sentence}'")
-                return False  # Sentence too long
+    try:
+        audio = AudioSegment.from_mp3(packed_path)
+    finally:
+        os.remove(packed_path)
 
-        except Exception as e:
-            self.logger.error(f"Error processing conversation ID {dialogue_id}: {e}")
-            return False  # Exception occurred
+    stage = "silence_split" if len(audio_paths) > 1 else "silence_trim"
+    with instrumentation.stage(stage, lines=len(audio_paths)) as span:
+        pieces = VoiceGenerator.split_on_pauses(audio, len(audio_paths)) if len(audio_paths) > 1 else [audio]
+        clips = []
+        for audio_path, piece in zip(audio_paths, pieces):
+            if os.path.lexists(audio_path):
+                # may be a link into the artifact store from an earlier attempt
+                os.remove(audio_path)
+            trimmed = VoiceGenerator.trim_silence(piece)
+            trimmed.export(audio_path, format="mp3")
+            span.bytes += os.path.getsize(audio_path)
+            clips.append((len(trimmed), trimmed.frame_rate))
+    return clips
 
 # Example usage:
 
@@ -206,4 +291,4 @@ if __name__ == "__main__":
     
     voice_generator = VoiceGenerator()
     for idx,line in enumerate(conversation_list):
-        voice_generator.process_conversation(line,idx)
+        voice_generator.process_group([(idx, line)])
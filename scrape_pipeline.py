@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import instrumentation
+from scrap_audio import extract_clips
+from scrape_policy import PauseSplitError, classify_failure
+
+
+def _init_extract_worker(run_id):
+    # spans from the worker processes belong to the same run as the parent's
+    os.environ["STEWIE_RUN_ID"] = run_id
+
+
+class ScrapePipeline:
+    """
+    Runs the scrape as overlapping stages instead of one line at a time:
+
+        browser (calling thread) -> download (thread pool) -> extract/trim (process pool)
+
+    The browser stage only asks for media URLs and moves straight on to the next group; each
+    download thread fetches its MP4, hands the CPU-bound extract + silence trim to a worker
+    process, stores the clips and reports them through `on_result` as soon as they are done.
+    At most `max_inflight` groups are past the browser stage at once, so a slow disk or CPU
+    makes the browser wait instead of piling up MP4s.
+
+    Env overrides:
+        VOICE_DOWNLOAD_WORKERS  download threads (default 4)
+        VOICE_EXTRACT_WORKERS   extract/trim processes (default 2)
+        VOICE_MAX_INFLIGHT      groups between the browser and the DB at once (default 8)
+    """
+
+    RUN, SKIP, STOP = "run", "skip", "stop"
+
+    def __init__(self, generator, download_workers=None, extract_workers=None, max_inflight=None):
+        self.generator = generator
+        self.download_workers = int(download_workers or os.getenv("VOICE_DOWNLOAD_WORKERS", 4))
+        self.extract_workers = int(extract_workers or os.getenv("VOICE_EXTRACT_WORKERS", 2))
+        self.max_inflight = int(max_inflight or os.getenv("VOICE_MAX_INFLIGHT", 8))
+        self.logger = logging.getLogger("VoiceGenerator")
+        self._pending = deque()
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._report_lock = threading.Lock()
+        self._on_result = None
+
+    def run(self, groups, admit, on_result):
+        """
+        Scrapes `groups` (lists of (dialogue_id, line), see VoiceGenerator.pack_lines).
+
+        admit(group) is called right before a group goes to the browser and returns RUN,
+        SKIP or STOP (STOP leaves it and everything after it for a later boot).
+        on_result(group, started_at, busy_s, results) is called once per group, from whichever
+        thread finished it, never concurrently; results are [(dialogue_id, success, failure_kind, asset)]
+        and busy_s is the browser time the group took.
+        """
+        self._pending.extend(groups)
+        self._on_result = on_result
+        # spawn, not fork: the parent already runs download threads when the first worker starts
+        extract_pool = ProcessPoolExecutor(
+            max_workers=self.extract_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_extract_worker,
+            initargs=(instrumentation.get_instrumentation().run_id,),
+        )
+        download_pool = ThreadPoolExecutor(max_workers=self.download_workers, thread_name_prefix="download")
+        try:
+            while True:
+                with self._cond:
+                    # a packed group that fails to split comes back as single lines, so wait
+                    # for in-flight work before deciding the queue is empty
+                    while not self._pending and self._inflight:
+                        self._cond.wait()
+                    if not self._pending:
+                        break
+                    group = self._pending.popleft()
+
+                decision = admit(group)
+                if decision == self.STOP:
+                    break
+                if decision == self.SKIP:
+                    continue
+
+                with self._cond:
+                    while self._inflight >= self.max_inflight:
+                        self._cond.wait()
+                    self._inflight += 1
+
+                started_at = time.time()
+                try:
+                    job = self.generator.request_group(group)
+                except Exception as e:
+                    self.logger.error(f"Error generating IDs {[i for i, _ in group]}: {e}")
+                    self._report(group, started_at, time.time() - started_at, self._failed(group, e))
+                    self._done()
+                    continue
+                busy_s = time.time() - started_at
+                download_pool.submit(self._finish, extract_pool, group, job, started_at, busy_s)
+                # same pacing between requests as the one-line-at-a-time loop
+                time.sleep(2)
+        finally:
+            download_pool.shutdown(wait=True)
+            extract_pool.shutdown(wait=True)
+
+    def _finish(self, extract_pool, group, job, started_at, busy_s):
+        """Download, extract and store one group, then report it (runs on a download thread)."""
+        try:
+            self.generator.download_video(job["url"], job["mp4_path"])
+            clips = extract_pool.submit(extract_clips, job["mp4_path"], job["audio_paths"]).result()
+            results = [
+                (dialogue_id, True, None, self.generator.store_clip(audio_path, duration_ms, sample_rate))
+                for dialogue_id, audio_path, (duration_ms, sample_rate) in zip(job["ids"], job["audio_paths"], clips)
+            ]
+            self._report(group, started_at, busy_s, results)
+        except PauseSplitError as e:
+            self.logger.warning(f"{e}; queueing IDs {job['ids']} one by one")
+            with self._cond:
+                self._pending.extendleft(reversed([[pair] for pair in group]))
+        except Exception as e:
+            self.logger.error(f"Error processing IDs {job['ids']}: {e}")
+            self._report(group, started_at, busy_s, self._failed(group, e))
+        finally:
+            if os.path.exists(job["mp4_path"]):
+                os.remove(job["mp4_path"])
+            self._done()
+
+    @staticmethod
+    def _failed(group, error):
+        kind = classify_failure(error)
+        return [(dialogue_id, False, kind, None) for dialogue_id, _ in group]
+
+    def _report(self, group, started_at, busy_s, results):
+        with self._report_lock:
+            try:
+                self._on_result(group, started_at, busy_s, results)
+            except Exception as e:
+                self.logger.error(f"Error recording IDs {[i for i, _ in group]}: {e}")
+
+    def _done(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
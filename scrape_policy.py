@@ -0,0 +1,124 @@
+import time
+import random
+import logging
+
+
+class ScrapeError(Exception):
+    """Base class for classified scrape failures. `kind` is what gets stored on the row."""
+    kind = "unknown"
+
+
+class VideoTimeoutError(ScrapeError):
+    """The <video> element never showed up after clicking Generate."""
+    kind = "video_timeout"
+
+
+class EmptySourceError(ScrapeError):
+    """The <video> element appeared but its src never became a media URL."""
+    kind = "empty_src"
+
+
+class DownloadError(ScrapeError):
+    """The media URL answered with an HTTP error."""
+    kind = "download_http"
+
+
+class GenerateRequestError(ScrapeError):
+    """The generate endpoint itself failed (HTTP error or a response we cannot read)."""
+    kind = "generate_http"
+
+
+class PauseSplitError(ScrapeError):
+    """A packed clip could not be cut back into one clip per line at the pauses."""
+    kind = "pause_split"
+
+
+class ExtractError(ScrapeError):
+    """Turning a downloaded clip into stored MP3s failed on this machine (ffmpeg, pydub, disk or store)."""
+    kind = "extract"
+
+
+class MalformedLineError(ScrapeError):
+    """The dialogue line itself is unusable (no "Speaker:" prefix or over the length limit)."""
+    kind = "malformed"
+
+
+def classify_failure(error):
+    """Map an exception raised while scraping to a failure kind."""
+    if isinstance(error, ScrapeError):
+        return error.kind
+    name = type(error).__name__
+    if name == "TimeoutException":
+        return "timeout"
+    module = type(error).__module__ or ""
+    if module.startswith("requests"):
+        return "download_http"
+    return "unknown"
+
+
+class RetryPolicy:
+    """
+    When a failed row may be tried again.
+
+    Backoff is exponential in the row's retry count with +/-50% jitter, so a burst of failures
+    does not make every row come back at the same moment. Malformed lines never get better,
+    so they are given up on immediately.
+    """
+
+    MAX_RETRIES = 5
+    PERMANENT = {"malformed"}
+    # failures that say nothing about the health of the site
+    NOT_SITE_FAILURES = {"malformed", "extract"}
+
+    def __init__(self, base_delay_s=120.0, max_delay_s=3600.0, jitter=0.5, rng=None):
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def is_permanent(self, kind):
+        return kind in self.PERMANENT
+
+    def counts_against_site(self, kind):
+        return kind not in self.NOT_SITE_FAILURES
+
+    def backoff_delay(self, retry_count):
+        delay = min(self.max_delay_s, self.base_delay_s * (2 ** retry_count))
+        return delay * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_eligible_at(self, retry_count, now=None):
+        return (now or time.time()) + self.backoff_delay(retry_count)
+
+
+class CircuitBreaker:
+    """
+    Per speaker page breaker, persisted in the DB so it survives VM reboots.
+
+    After `threshold` consecutive site failures on a page the breaker opens for `cooldown_s`;
+    lines for that page are skipped without spending a retry. Once the cooldown is over one
+    line is let through: success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, db, threshold=3, cooldown_s=1800.0):
+        self.db = db
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.logger = logging.getLogger("CircuitBreaker")
+
+    def allow(self, page, now=None):
+        state = self.db.get_circuit(page)
+        if state["opened_until"] and (now or time.time()) < state["opened_until"]:
+            return False
+        return True
+
+    def record_success(self, page):
+        self.db.save_circuit(page, 0, None)
+
+    def record_failure(self, page, now=None):
+        state = self.db.get_circuit(page)
+        failures = state["consecutive_failures"] + 1
+        opened_until = None
+        if failures >= self.threshold:
+            opened_until = (now or time.time()) + self.cooldown_s
+            self.logger.warning(f"Circuit open for {page} after {failures} consecutive failures")
+        self.db.save_circuit(page, failures, opened_until)
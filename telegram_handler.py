@@ -13,7 +13,8 @@ class TelegramBot:
         # Fetch credentials from environment
         self.BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
         self.CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
-        self.url = f'https://api.telegram.org/bot{self.BOT_TOKEN}/'
+        self.api_base = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+        self.url = f'{self.api_base}/bot{self.BOT_TOKEN}/'
         self.update_id_file = "last_update_id.txt"
 
     def send_message(self, text):
@@ -39,9 +40,9 @@ class TelegramBot:
         except Exception as e:
             self.log_error(f"Failed to send video file: {e}")
 
-    def get_updates(self, offset=None):
+    def get_updates(self, offset=None, timeout=10):
         """Fetch new updates from Telegram."""
-        params = {'timeout': 10, 'offset': offset}
+        params = {'timeout': timeout, 'offset': offset}
         try:
             response = requests.get(f'{self.url}getUpdates', params=params)
             return response.json()
@@ -114,6 +115,20 @@ class TelegramBot:
 
         self.send_message("Timeout: No valid content received in 15 minutes.")
 
+    def cancel_requested(self, since):
+        """
+        True if "cancel" was sent after the `since` timestamp. Does not wait. Updates are only
+        acknowledged when a cancel is found, so a script sent meanwhile is still there for stage 0.
+        """
+        updates = self.get_updates(self.get_last_update_id(), timeout=0)
+        for update in updates.get('result', []):
+            message = update.get('message', {})
+            text = (message.get('text') or '').strip().lower()
+            if text == 'cancel' and message.get('date', 0) >= int(since):
+                self.set_last_update_id(update['update_id'] + 1)
+                return True
+        return False
+
     def log_error(self, message):
         """Log an error to a file with timestamp."""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
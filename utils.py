@@ -3,7 +3,7 @@ import re
 from typing import List
 from datetime import datetime
 import subprocess
-import shutil
+import hashlib
 class Utils:
     """
     A utility class providing common helper functions for various tasks.
@@ -21,6 +21,15 @@ class Utils:
             print(f"An error occurred: {e}")
            
 
+    @staticmethod
+    def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+        """Hex sha256 of a file's content, read in chunks."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
     @staticmethod
     def get_ordered_audio_files(folder_path: str) -> List[str]:
         """
@@ -49,24 +58,26 @@ class Utils:
 
 
     @staticmethod
-    def archive_audio_assets():
+    def archive_audio_assets(store=None):
         """
-        Moves all files from 'audio_assets/' to 'archive/YYYY-MM-DD/' and ensures the source folder is empty.
+        Archives all files from 'audio_assests/' under 'archive/YYYY-MM-DD_HH-MM-SS/<file>' in the
+        artifact store and empties the source folder. Files already in the store are not copied,
+        they just get an archive ref; archived audio is evicted by the store's GC when space runs out.
         """
+        from artifact_store import ArtifactStore
+
         source_dir = 'audio_assests'
-        archive_root = 'archives_audios'
         today_str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        target_dir = os.path.join(archive_root, today_str)
+        store = store or ArtifactStore()
 
         try:
-            os.makedirs(target_dir, exist_ok=True)
-
             for filename in os.listdir(source_dir):
                 src_path = os.path.join(source_dir, filename)
                 if os.path.isfile(src_path):
-                    shutil.move(src_path, os.path.join(target_dir, filename))
+                    store.put_file(src_path, name=f"archive/{today_str}/{filename}", keep=False)
+                    store.release(f"audio/{filename}")
 
-            print(f"Archived files to {target_dir}.")
+            print(f"Archived files to archive/{today_str}.")
         except Exception as e:
             print(f"[Utils] Error archiving audio assets: {e}")
 
@@ -0,0 +1,239 @@
+import os
+import time
+import logging
+from urllib.parse import urljoin, urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import instrumentation
+from scrape_policy import VideoTimeoutError, EmptySourceError, GenerateRequestError
+
+# what VOICE_BACKENDS defaults to; the HTTP backend's endpoint is not confirmed yet
+DEFAULT_BACKENDS = "selenium"
+
+
+class VoiceBackend:
+    """
+    Turns a sentence into a media URL on a speaker's Parrot page.
+    `generate` returns the URL or raises a ScrapeError subclass.
+    """
+
+    name = "base"
+
+    def generate(self, page_url, sentence, index):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HttpVoiceBackend(VoiceBackend):
+    """
+    Sends a generate request over a pooled requests.Session, no browser involved.
+
+    The request shape ({"voice", "text"} POSTed to /api/generate) is assumed, not confirmed
+    against the real site; only the local stand-in (benchmarks/fake_services.py) is known to
+    speak it. Opt in with VOICE_BACKENDS=http,selenium once the real request is verified.
+
+    The endpoint answers either with the media URL right away ({"url": ...}) or with a job to
+    poll ({"id"/"status_url": ...}); the job's status is polled until it has a URL.
+
+    Env overrides:
+        PARROT_GENERATE_URL  generate endpoint (default <PARROT_BASE_URL>/api/generate)
+    """
+
+    name = "http"
+
+    def __init__(self, base_url, session=None, generate_url=None, timeout_s=30.0, poll_interval_s=1.0):
+        self.base_url = base_url.rstrip("/")
+        self.generate_url = generate_url or os.getenv("PARROT_GENERATE_URL", f"{self.base_url}/api/generate")
+        self.session = session or self.create_session()
+        self.timeout_s = timeout_s
+        self.poll_interval_s = poll_interval_s
+        self.logger = logging.getLogger("VoiceGenerator")
+
+    @staticmethod
+    def create_session(pool_size=8):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @staticmethod
+    def voice_for_page(page_url):
+        """'.../ai-voice/peter-griffin' -> 'peter-griffin'"""
+        return urlparse(page_url).path.rstrip("/").rsplit("/", 1)[-1]
+
+    def _json(self, response):
+        if response.status_code != 200:
+            raise GenerateRequestError(f"Generate request failed with HTTP {response.status_code}: {response.url}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise GenerateRequestError(f"Generate endpoint did not return JSON: {response.url}") from e
+
+    def generate(self, page_url, sentence, index):
+        voice = self.voice_for_page(page_url)
+        with instrumentation.stage("generate", speaker=voice, dialogue_id=index, backend=self.name):
+            try:
+                data = self._json(self.session.post(
+                    self.generate_url, json={"voice": voice, "text": sentence}, timeout=self.timeout_s
+                ))
+                deadline = time.time() + self.timeout_s
+                status_url = data.get("status_url") or (data.get("id") and f"{self.base_url}/api/status/{data['id']}")
+                while not data.get("url"):
+                    if data.get("status") == "failed":
+                        raise EmptySourceError(f"Generate job failed: {data}")
+                    if not status_url:
+                        raise EmptySourceError(f"Generate response has no media URL: {data}")
+                    if time.time() > deadline:
+                        raise VideoTimeoutError(f"Generate job did not finish within {self.timeout_s:.0f}s")
+                    time.sleep(self.poll_interval_s)
+                    data = self._json(self.session.get(urljoin(self.generate_url, status_url), timeout=self.timeout_s))
+            except requests.exceptions.RequestException as e:
+                raise GenerateRequestError(str(e)) from e
+
+        url = urljoin(self.generate_url, data["url"])
+        if not url.startswith(("https://", "http://")):
+            raise EmptySourceError(f"Generate returned an unusable URL: {url}")
+        return url
+
+
+class SeleniumVoiceBackend(VoiceBackend):
+    """
+    Drives the real page in headless Chrome: type the sentence, click Generate and wait for
+    the <video> src. Chrome is only started the first time it is needed.
+    """
+
+    name = "selenium"
+
+    def __init__(self):
+        self.driver = None
+        self.logger = logging.getLogger("VoiceGenerator")
+
+    def setup_driver(self):
+        """Setup the WebDriver for Selenium"""
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        try:
+            options = Options()
+            options.add_argument("--headless")
+            options.add_argument("--window-size=1920,1080")
+            driver = webdriver.Chrome(options=options)
+            self.logger.info("WebDriver initialized successfully.")
+            return driver
+        except Exception as e:
+            self.logger.error(f"Error initializing WebDriver: {e}")
+            raise
+
+    def generate(self, page_url, sentence, index):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.common.exceptions import TimeoutException
+
+        if self.driver is None:
+            self.driver = self.setup_driver()
+        speaker = HttpVoiceBackend.voice_for_page(page_url)
+
+        # Load the page
+        with instrumentation.stage("page_load", speaker=speaker, dialogue_id=index):
+            self.driver.delete_all_cookies()
+            self.logger.info("Cookies cleared.")
+            self.driver.get(page_url)
+
+            # Input text
+            textarea = WebDriverWait(self.driver, 30).until(
+                EC.presence_of_element_located((By.TAG_NAME, "textarea"))
+            )
+
+        with instrumentation.stage("generate", speaker=speaker, dialogue_id=index, backend=self.name):
+            textarea.clear()
+            textarea.send_keys(sentence)
+
+            # Click generate
+            generate_btn = self.driver.find_element(By.XPATH, '//button[contains(text(), "Generate")]')
+            generate_btn.click()
+
+            # Wait for video
+            try:
+                video = WebDriverWait(self.driver, 30).until(
+                    EC.presence_of_element_located((By.TAG_NAME, "video"))
+                )
+            except TimeoutException as e:
+                raise VideoTimeoutError("Timed out waiting for the <video> element") from e
+
+            for _ in range(30):
+                src = video.get_attribute("src")
+                if src and src.startswith(("https://", "http://")):
+                    return src
+                time.sleep(1)
+
+            # raised inside the span so the failed poll is recorded as an error
+            self.logger.warning("Video URL not found.")
+            raise EmptySourceError("The <video> src never became a media URL")
+
+    def close(self):
+        """Quit the browser so Chrome does not outlive the boot"""
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+            self.logger.info("WebDriver closed.")
+        except Exception as e:
+            self.logger.error(f"Error closing WebDriver: {e}")
+        self.driver = None
+
+
+class FallbackVoiceBackend(VoiceBackend):
+    """
+    Tries each backend in order and returns the first URL. A backend that fails
+    `disable_after` times in a row is skipped for the rest of the boot, so a site change that
+    breaks the HTTP path costs a couple of requests, not one per line.
+    """
+
+    name = "fallback"
+
+    def __init__(self, backends, disable_after=2):
+        self.backends = list(backends)
+        self.disable_after = disable_after
+        self.failures = {backend.name: 0 for backend in self.backends}
+        self.last_backend = None
+        self.logger = logging.getLogger("VoiceGenerator")
+
+    def generate(self, page_url, sentence, index):
+        last_error = None
+        candidates = [b for b in self.backends if self.failures[b.name] < self.disable_after] or self.backends[-1:]
+        for backend in candidates:
+            try:
+                url = backend.generate(page_url, sentence, index)
+                self.failures[backend.name] = 0
+                self.last_backend = backend.name
+                return url
+            except Exception as e:
+                self.failures[backend.name] += 1
+                self.logger.warning(f"{backend.name} voice backend failed for ID {index}: {e}")
+                last_error = e
+        raise last_error
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
+
+
+def create_backend(base_url, session=None, names=None):
+    """
+    Backend chain from VOICE_BACKENDS (comma separated, default DEFAULT_BACKENDS; the HTTP
+    backend's endpoint is not confirmed yet, see HttpVoiceBackend).
+    """
+    names = names or [n.strip() for n in os.getenv("VOICE_BACKENDS", DEFAULT_BACKENDS).split(",") if n.strip()]
+    backends = []
+    for name in names:
+        if name == "http":
+            backends.append(HttpVoiceBackend(base_url, session=session))
+        elif name == "selenium":
+            backends.append(SeleniumVoiceBackend())
+        else:
+            raise ValueError(f"Unknown voice backend: {name}")
+    return backends[0] if len(backends) == 1 else FallbackVoiceBackend(backends)